@@ -1,14 +1,23 @@
 import streamlit as st
+import copy
+import hashlib
 import json
-from datetime import datetime, date
+import re
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from uuid import uuid4
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Tuple
 
 from modules import db
 # from modules import invoice as invoice_mod # Lazy load in action_generate_pdf to save RAM/Startup
 from modules.invoice_state import (
     load_db_settings, 
     invalidate_pdf, 
+    bump_items_version,
+    start_request_clock,
+    request_now,
+    request_today_str,
+    cart_totals,
     generate_invoice_no, 
     DEFAULT_FOOTER_ITEMS,
     DEFAULT_INVOICE_TITLE,
@@ -18,55 +27,135 @@ from modules.invoice_state import (
 from modules.utils import (
     safe_float, 
     safe_int, 
-    normalize_desc_text, 
-    desc_to_lines, 
-    calculate_totals
+    desc_lines_cached,
 )
 
+# --- Optional fast JSON encoder ---
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+
 # --- Constants for Callbacks ---
 MIN_QTY = 1
 
+# Invoice-number patterns (compiled once; used on client-name keystrokes)
+_INV_REVISION_RE = re.compile(r'(.*-)([0-9]+)$')   # INV-NAME-001 -> revision bump
+_INV_DRAFT_RE = re.compile(r'^(INV\d+)(?:_.*)?$')  # INV001 or INV001_ANYTHING
+_INV_DIGITS_RE = re.compile(r'(\d+)')
+
+# Fields kept per merged item in _bundle_src (the PDF reads Description/Details;
+# cb_unmerge_bundle recomputes Total/_line_total from Price/Qty)
+_BUNDLE_SRC_FIELDS = ("__id", "_row_id", "Description", "Details", "Price", "Qty", "category")
+
 # --- Helpers ---
 
+def _dumps_payload(payload: Dict[str, Any]) -> str:
+    """Serializes the invoice payload for the DB (orjson if installed)."""
+    if HAS_ORJSON:
+        try:
+            return orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS).decode()
+        except TypeError:
+            pass  # e.g. ints beyond 64-bit; stdlib handles those
+    return json.dumps(payload)
+
+@lru_cache(maxsize=1024)
+def item_widget_keys(item_id: str) -> Tuple[str, str, str, str, str]:
+    """(sel, qty, bundle_price, unmerge, del) widget keys for a cart row.
+
+    Cart ids are stable across reruns, so the keys are formatted once per
+    item instead of five f-strings per row on every render.
+    """
+    return (
+        f"sel_{item_id}", f"qty_{item_id}", f"bundle_price_{item_id}",
+        f"unmerge_{item_id}", f"del_{item_id}",
+    )
+
 def _cleanup_qty_keys_for_item(item: Dict[str, Any]) -> None:
     item_id = item.get("__id")
-    if not item_id:
-        return
-    qty_key = f"qty_{item_id}"
-    if qty_key in st.session_state:
-        del st.session_state[qty_key]
+    if item_id:
+        st.session_state.pop(item_widget_keys(item_id)[1], None)
 
 def _cleanup_bundle_price_key_for_item(item: Dict[str, Any]) -> None:
     item_id = item.get("__id")
-    if not item_id:
-        return
-    k = f"bundle_price_{item_id}"
-    if k in st.session_state:
-        del st.session_state[k]
+    if item_id:
+        st.session_state.pop(item_widget_keys(item_id)[2], None)
+
+def pos_widget_ids() -> set:
+    """Ids of cart rows rendered by render_pos_section (which adds to it).
+
+    Qty/bundle-price widgets only exist for rendered rows, so the cleanups
+    below walk this set instead of scanning every session key.
+    """
+    return st.session_state.setdefault("_pos_widget_ids", set())
+
+def _purge_widget_keys(slot: int) -> None:
+    ss = st.session_state
+    for item_id in pos_widget_ids():
+        ss.pop(item_widget_keys(item_id)[slot], None)
 
 def cleanup_all_qty_keys() -> None:
-    for k in list(st.session_state.keys()):
-        if str(k).startswith("qty_"):
-            del st.session_state[k]
+    _purge_widget_keys(1)
 
 def cleanup_all_bundle_price_keys() -> None:
-    for k in list(st.session_state.keys()):
-        if str(k).startswith("bundle_price_"):
-            del st.session_state[k]
-
-def _cart_non_bundle_items() -> List[Dict[str, Any]]:
-    out = []
-    for it in st.session_state.get("inv_items", []):
-        if not it.get("_bundle"):
-            out.append(it)
-    return out
-
-def _cart_bundle_items() -> List[Dict[str, Any]]:
-    out = []
-    for it in st.session_state.get("inv_items", []):
-        if it.get("_bundle"):
-            out.append(it)
-    return out
+    _purge_widget_keys(2)
+
+def wa_template_parts(template: str) -> List[str]:
+    """Template split once on {nama}/{inv_no}; odd entries are "N"/"I" markers."""
+    if st.session_state.get("_wa_parts_src") != template:
+        marked = (
+            template.replace("\x00", "")
+            .replace("{nama}", "\x00N\x00")
+            .replace("{inv_no}", "\x00I\x00")
+        )
+        st.session_state["_wa_parts"] = marked.split("\x00")
+        st.session_state["_wa_parts_src"] = template
+    return st.session_state["_wa_parts"]
+
+def _footer_info() -> List[str]:
+    """Footer lines for meta; re-split only when inv_footer text changes."""
+    raw = str(st.session_state.get("inv_footer", ""))
+    if st.session_state.get("_footer_info_src") != raw:
+        st.session_state["_footer_info_cached"] = [x.strip() for x in raw.split("\n") if x.strip()]
+        st.session_state["_footer_info_src"] = raw
+    return st.session_state["_footer_info_cached"]
+
+def _items_by_id() -> Dict[str, Tuple[int, Dict[str, Any]]]:
+    """Maps __id -> (index, item) for inv_items, rebuilt only when the cart
+    structure changes (bump_items_version) or the list is replaced."""
+    ss = st.session_state
+    items = ss["inv_items"]
+    key = (id(items), ss.get("_items_struct_version", 0))
+    cached = ss.get("_items_index")
+    if cached is None or cached[0] != key:
+        cached = (key, {it.get("__id"): (i, it) for i, it in enumerate(items)})
+        ss["_items_index"] = cached
+    return cached[1]
+
+def _items_by_row_id() -> Dict[str, Tuple[int, Dict[str, Any]]]:
+    """_row_id (package id) -> (index, item) of the first cart item with it;
+    same invalidation as _items_by_id.
+
+    Derived from inv_items rather than maintained alongside it, so it can
+    never drift out of sync with the cart.
+    """
+    ss = st.session_state
+    items = ss.get("inv_items", [])
+    key = (id(items), ss.get("_items_struct_version", 0))
+    cached = ss.get("_row_ids")
+    if cached is None or cached[0] != key:
+        index: Dict[str, Tuple[int, Dict[str, Any]]] = {}
+        for i, it in enumerate(items):
+            index.setdefault(str(it.get("_row_id")), (i, it))
+        cached = (key, index, frozenset(index))
+        ss["_row_ids"] = cached
+    return cached[1]
+
+def cart_row_ids() -> frozenset:
+    """_row_id of every cart item (see _items_by_row_id)."""
+    _items_by_row_id()
+    return st.session_state["_row_ids"][2]
 
 # --- Main Callbacks ---
 
@@ -77,8 +166,7 @@ def cb_update_invoice_no() -> None:
         # For edits, increment revision
         current = st.session_state.get("inv_no", "")
         if current:
-            import re
-            match = re.match(r'(.*-)([0-9]+)$', current)
+            match = _INV_REVISION_RE.match(current)
             if match:
                 base, num = match.groups()
                 st.session_state["inv_no"] = f"{base}{int(num)+1:03d}"
@@ -109,10 +197,7 @@ def cb_client_name_changed() -> None:
     # e.g. INV001_OLD -> INV001_RISA
     # e.g. MY_CUSTOM_NO -> do nothing
     
-    import re
-    # Pattern: ^(INV\d+)(?:_.*)?$
-    # Matches INV001 or INV001_ANYTHING
-    match = re.match(r'^(INV\d+)(?:_.*)?$', current_no)
+    match = _INV_DRAFT_RE.match(current_no)
     
     if match and client_name:
         base_prefix = match.group(1) # e.g. INV001
@@ -128,6 +213,19 @@ def cb_client_name_changed() -> None:
         st.session_state["inv_no"] = new_no
         st.toast(f"Invoice No updated to: {new_no}", icon="🤖")
 
+def cb_wa_template_changed() -> None:
+    """Cleans the edited WhatsApp template once and pre-splits it."""
+    tmpl = st.session_state.get("wa_template", "")
+    if "\ufffd" in tmpl:
+        tmpl = tmpl.replace("\ufffd", " ")
+        st.session_state["wa_template"] = tmpl
+    wa_template_parts(tmpl)
+
+def cb_footer_changed() -> None:
+    """Footer edited: invalidate the PDF and pre-split the lines."""
+    invalidate_pdf()
+    _footer_info()
+
 def cb_add_item_to_cart(package: Dict[str, Any]) -> None:
     try:
         row_id = str(package.get("id", package.get("name", ""))).strip()
@@ -135,48 +233,49 @@ def cb_add_item_to_cart(package: Dict[str, Any]) -> None:
             st.toast("Invalid item data.", icon="⚠️")
             return
 
-        current_items = st.session_state["inv_items"]
-        if any(str(item.get("_row_id")) == row_id for item in current_items):
+        if row_id in cart_row_ids():
             st.toast("Item already in cart!", icon="⚠️")
             return
 
         price = safe_float(package.get("price", 0))
         new_item = {
-            "__id": str(uuid4()),
+            "__id": uuid4().hex,
             "_row_id": row_id,
             "Description": str(package.get("name", "Unnamed")),
             "Details": str(package.get("description", "")),
             "Price": price,
             "Qty": 1,
             "Total": price,
+            "_line_total": price,
             "category": str(package.get("category", "")),
         }
 
         st.session_state["inv_items"].append(new_item)
+        bump_items_version()
         invalidate_pdf()
         st.toast(f"Added: {new_item['Description']}", icon="🛒")
     except Exception as e:
         st.error(f"Failed to add item: {e}")
 
+def _item_price(item: Dict[str, Any]) -> float:
+    # Price is stored numeric by every mutator; safe_float only for odd legacy data
+    price = item.get("Price", 0)
+    return price if isinstance(price, (int, float)) else safe_float(price)
+
 def cb_update_item_qty(item_id: str, widget_key: str) -> None:
-    items = st.session_state["inv_items"]
     # Find item by ID
-    found_idx = -1
-    for i, it in enumerate(items):
-        if str(it.get("__id")) == str(item_id):
-            found_idx = i
-            break
-            
-    if found_idx == -1:
+    found = _items_by_id().get(item_id)
+    if found is None:
         return
 
-    item = items[found_idx]
+    item = found[1]
 
     # Guard: bundle qty always 1
     if item.get("_bundle"):
         item["Qty"] = 1
-        item["Total"] = safe_float(item.get("Price", 0)) * 1
+        item["Total"] = item["_line_total"] = _item_price(item)
         st.session_state[widget_key] = 1
+        bump_items_version(structural=False)
         invalidate_pdf()
         return
 
@@ -184,50 +283,38 @@ def cb_update_item_qty(item_id: str, widget_key: str) -> None:
     new_qty = max(MIN_QTY, safe_int(raw_value, 1))
 
     item["Qty"] = new_qty
-    item["Total"] = safe_float(item.get("Price", 0)) * new_qty
+    item["Total"] = item["_line_total"] = _item_price(item) * new_qty
+    bump_items_version(structural=False)
     invalidate_pdf()
 
 def cb_delete_item(item_id: str) -> None:
-    items = st.session_state["inv_items"]
-    found_idx = -1
-    for i, it in enumerate(items):
-        if str(it.get("__id")) == str(item_id):
-            found_idx = i
-            break
-            
-    if found_idx == -1:
+    found = _items_by_id().get(item_id)
+    if found is None:
         return
 
-    item = items[found_idx]
+    found_idx, item = found
+    items = st.session_state["inv_items"]
     _cleanup_qty_keys_for_item(item)
     _cleanup_bundle_price_key_for_item(item)
     items.pop(found_idx)
+    bump_items_version()
     invalidate_pdf()
 
 def cb_delete_item_by_row_id(row_id: str) -> None:
     """Delete item from cart using the original Package ID (_row_id)."""
-    items = st.session_state["inv_items"]
-    found_idx = -1
-    for i, it in enumerate(items):
-        if str(it.get("_row_id")) == str(row_id):
-            found_idx = i
-            break
-            
-    if found_idx != -1:
-        # Get actual UUID to clean up keys
-        item = items[found_idx]
+    found = _items_by_row_id().get(str(row_id))
+    if found is not None:
+        idx, item = found
+        st.session_state["inv_items"].pop(idx)
+        # Clean up widget keys by the item's actual UUID
         _cleanup_qty_keys_for_item(item)
-        items.pop(found_idx)
+        bump_items_version()
         invalidate_pdf()
         st.toast("Packet removed!", icon="🗑️")
 
 def cb_update_bundle_price(item_id: str, widget_key: str) -> None:
-    items = st.session_state["inv_items"]
-    item = None
-    for it in items:
-        if str(it.get("__id")) == str(item_id):
-            item = it
-            break
+    found = _items_by_id().get(item_id)
+    item = found[1] if found else None
             
     if not item or not item.get("_bundle"):
         return
@@ -235,7 +322,8 @@ def cb_update_bundle_price(item_id: str, widget_key: str) -> None:
     v = max(0, safe_int(st.session_state.get(widget_key, 0), 0))
     item["Price"] = float(v)
     item["Qty"] = 1
-    item["Total"] = float(v)
+    item["Total"] = item["_line_total"] = float(v)
+    bump_items_version(structural=False)
     invalidate_pdf()
 
 
@@ -259,12 +347,8 @@ def cb_fill_remaining_payment(grand_total: float) -> None:
          st.toast("Pelunasan term not found.", icon="⚠️")
          return
 
-    # Sum all OTHER terms
-    current_paid = 0
-    for i, t in enumerate(terms):
-        if i != full_idx:
-            current_paid += safe_int(t.get("amount", 0), 0)
-
+    # Sum all OTHER terms (int math throughout)
+    current_paid = sum(safe_int(t.get("amount", 0), 0) for i, t in enumerate(terms) if i != full_idx)
     remaining = max(0, int(grand_total) - current_paid)
     
     # Update term list
@@ -279,82 +363,75 @@ def cb_fill_remaining_payment(grand_total: float) -> None:
     invalidate_pdf()
     st.toast("Remaining balance added to Pelunasan.", icon="✅")
 
+# Widget-bound keys: pop() (not assignment) avoids the "cannot be modified
+# after instantiation" error; initialize_session_state re-seeds them.
+_RESET_POP_KEYS = (
+    "inv_cashback", "inv_title", "wa_template",
+    "inv_client_name", "inv_client_phone", "inv_client_email",
+    "inv_venue", "inv_hours", "inv_notes", "inv_wedding_date", "inv_no",
+    "_draft_global_seq",  # Force re-fetch of next sequence
+    "_init_done",  # Re-run full defaults pass
+    "_pdf_last",  # Drop remembered render (in-flight: invalidate_pdf below)
+    "pp_cached_hashes",  # Proof digests (rebuilt from pp_cached on demand)
+)
+
 def cb_reset_transaction() -> None:
-    st.session_state["inv_items"] = []
-    # Use pop() for widget-bound keys to avoid "cannot be modified after instantiation" error
-    st.session_state.pop("inv_cashback", None)
-    st.session_state["generated_pdf_bytes"] = None
-    st.session_state["pp_cached"] = []  # Clear Payment Proofs
-    
-    # Clear Metadata - use pop() for widget-bound keys
+    ss = st.session_state
     db_conf = load_db_settings()
-    st.session_state.pop("inv_title", None)
-    st.session_state["_default_inv_title"] = db_conf["title"]
-    
-    # Reload Configs (FORCE RESET to Global Defaults)
-    st.session_state["inv_terms"] = db_conf["terms"]
-    st.session_state["_default_inv_terms"] = db_conf["terms"]
-    
-    st.session_state["bank_nm"] = db_conf["bank_nm"]
-    st.session_state["_default_bank_nm"] = db_conf["bank_nm"]
-    
-    st.session_state["bank_ac"] = db_conf["bank_ac"]
-    st.session_state["_default_bank_ac"] = db_conf["bank_ac"]
-    
-    st.session_state["bank_an"] = db_conf["bank_an"]
-    st.session_state["_default_bank_an"] = db_conf["bank_an"]
-    
-    st.session_state["inv_footer"] = db_conf["inv_footer"]
-    st.session_state["_default_inv_footer"] = db_conf["inv_footer"]
-    
-    # WA Template needs special handling as it might not be in db_conf dict directly if not loaded by load_db_settings main query
-    st.session_state.pop("wa_template", None) 
-
-    st.session_state.pop("inv_client_name", None)
-    st.session_state.pop("inv_client_phone", None)
-    st.session_state.pop("inv_client_email", None)
-    st.session_state.pop("inv_venue", None)
-    st.session_state.pop("inv_hours", None)
-    st.session_state.pop("inv_notes", None)
-    st.session_state.pop("inv_wedding_date", None)
-    st.session_state.pop("inv_no", None)
-    st.session_state.pop("_draft_global_seq", None)  # Force re-fetch of next sequence
-    
-    st.session_state["payment_terms"] = [
-        {"id": "dp", "label": "Down Payment", "amount": 0, "locked": True},
-        {"id": "full", "label": "Pelunasan", "amount": 0, "locked": True},
-    ]
-    st.session_state["editing_invoice_id"] = None  # Clear edit mode
+    invalidate_pdf()
+    for k in _RESET_POP_KEYS:
+        ss.pop(k, None)
+
+    # Reload Configs (FORCE RESET to Global Defaults); _default_* flags are
+    # consumed by initialize_session_state
+    ss.update({
+        "inv_items": [],
+        "generated_pdf_bytes": None,
+        "pp_cached": [],  # Clear Payment Proofs
+        "_default_inv_title": db_conf["title"],
+        "inv_terms": db_conf["terms"],
+        "_default_inv_terms": db_conf["terms"],
+        "bank_nm": db_conf["bank_nm"],
+        "_default_bank_nm": db_conf["bank_nm"],
+        "bank_ac": db_conf["bank_ac"],
+        "_default_bank_ac": db_conf["bank_ac"],
+        "bank_an": db_conf["bank_an"],
+        "_default_bank_an": db_conf["bank_an"],
+        "inv_footer": db_conf["inv_footer"],
+        "_default_inv_footer": db_conf["inv_footer"],
+        "payment_terms": [
+            {"id": "dp", "label": "Down Payment", "amount": 0, "locked": True},
+            {"id": "full", "label": "Pelunasan", "amount": 0, "locked": True},
+        ],
+        "editing_invoice_id": None,  # Clear edit mode
+        # Reset file uploader widget by changing its key
+        "uploader_key": ss.get("uploader_key", 0) + 1,
+        # Force refresh to close popover and scroll to top
+        "nav_key": ss.get("nav_key", 0) + 1,
+        "_needs_rerun": True,
+    })
+    bump_items_version()
     cleanup_all_qty_keys()
     cleanup_all_bundle_price_keys()
-    
-    # Reset file uploader widget by changing its key
-    st.session_state["uploader_key"] = st.session_state.get("uploader_key", 0) + 1
-    
-    # Force refresh to close popover and scroll to top
-    st.session_state["nav_key"] = st.session_state.get("nav_key", 0) + 1
-    st.session_state["_needs_rerun"] = True
+    pos_widget_ids().clear()
 
 def cb_merge_selected_from_ui() -> None:
     sel_ids: List[str] = st.session_state.get("bundle_sel", []) or []
-    sel_ids = [str(x) for x in sel_ids if str(x)]
+    sel_ids = [x for x in sel_ids if x]
     if len(sel_ids) < 2:
         st.toast("Select at least 2 items to merge.", icon="⚠️")
         return
 
-    # map id -> item
-    items = st.session_state.get("inv_items", [])
-    id_to_item = {str(it.get("__id")): it for it in items}
-
+    # Partition the cart in one pass (cart order); no side effects until validated
+    sel_set = set(sel_ids)
     selected: List[Dict[str, Any]] = []
-    for sid in sel_ids:
-        it = id_to_item.get(sid)
-        if not it:
-            continue
-        if it.get("_bundle"):
-            st.toast("Cannot merge a bundle item.", icon="⚠️")
-            return
-        selected.append(it)
+    remaining: List[Dict[str, Any]] = []
+    for it in st.session_state["inv_items"]:
+        (selected if it.get("__id") in sel_set else remaining).append(it)
+
+    if any(it.get("_bundle") for it in selected):
+        st.toast("Cannot merge a bundle item.", icon="⚠️")
+        return
 
     if len(selected) < 2:
         st.toast("Selected items not found.", icon="⚠️")
@@ -378,43 +455,40 @@ def cb_merge_selected_from_ui() -> None:
             price += safe_float(it.get("Price", 0)) * max(1, safe_int(it.get("Qty", 1), 1))
 
     # merged details
-    merged_lines: List[str] = []
+    def _merged_lines():
+        for it in selected:
+            nm = str(it.get("Description", "")).strip()
+            if nm:
+                yield nm
+            for ln in desc_lines_cached(str(it.get("Details") or "")):
+                yield f"- {ln}"
+            yield ""  # spacer
+    merged_details = "\n".join(_merged_lines()).strip()
+
+    # remove selected from cart (remaining was partitioned above)
     for it in selected:
-        nm = str(it.get("Description", "")).strip()
-        if nm:
-            merged_lines.append(nm)
-        det = normalize_desc_text(it.get("Details", ""))
-        det_lines = desc_to_lines(det)
-        for ln in det_lines:
-            merged_lines.append(f"- {ln}")
-        merged_lines.append("")  # spacer
-    merged_details = "\n".join([x for x in merged_lines]).strip()
-
-    # remove selected from cart
-    remaining: List[Dict[str, Any]] = []
-    selected_id_set = set(sel_ids)
-    for it in st.session_state["inv_items"]:
-        if str(it.get("__id")) in selected_id_set:
-            _cleanup_qty_keys_for_item(it)
-            _cleanup_bundle_price_key_for_item(it)
-        else:
-            remaining.append(it)
+        _cleanup_qty_keys_for_item(it)
+        _cleanup_bundle_price_key_for_item(it)
 
     # bundle item
     bundle_item = {
-        "__id": str(uuid4()),
-        "_row_id": "bundle:" + str(uuid4()),
+        "__id": uuid4().hex,
+        "_row_id": "bundle:" + uuid4().hex,
         "Description": title,
         "Details": merged_details,
         "Price": float(price),
         "Qty": 1,
         "Total": float(price),
+        "_line_total": float(price),
         "_bundle": True,
         "category": "Bundling Package",
-        "_bundle_src": [dict(x) for x in selected],  # store shallow copies for unmerge
+        # Trimmed copies for unmerge; dicts (not tuples) since saved invoices
+        # and modules/invoice.py read this list back by field name
+        "_bundle_src": [{k: x[k] for k in _BUNDLE_SRC_FIELDS if k in x} for x in selected],
     }
 
     st.session_state["inv_items"] = remaining + [bundle_item]
+    bump_items_version()
 
     # reset UI selection
     st.session_state["bundle_sel"] = []
@@ -425,39 +499,38 @@ def cb_merge_selected_from_ui() -> None:
     st.toast("Bundling created.", icon="✅")
 
 def cb_unmerge_bundle(bundle_id: str) -> None:
-    bundle_id = str(bundle_id)
-    items = st.session_state.get("inv_items", [])
-    new_items: List[Dict[str, Any]] = []
-    restored: List[Dict[str, Any]] = []
-
-    for it in items:
-        if str(it.get("__id")) == bundle_id and it.get("_bundle"):
-            restored = it.get("_bundle_src") or []
-            _cleanup_qty_keys_for_item(it)
-            _cleanup_bundle_price_key_for_item(it)
-        else:
-            new_items.append(it)
+    hit = _items_by_id().get(bundle_id)
+    bundle = hit[1] if hit else None
+    restored: List[Dict[str, Any]] = (bundle.get("_bundle_src") or []) if bundle and bundle.get("_bundle") else []
 
     if not restored:
         st.toast("Nothing to unmerge.", icon="ℹ️")
         return
 
+    _cleanup_qty_keys_for_item(bundle)
+    _cleanup_bundle_price_key_for_item(bundle)
+    new_items = [it for it in st.session_state["inv_items"] if it is not bundle]
+
     # restore original items (make sure they still have required keys)
+    _sf, _si = safe_float, safe_int
     for r in restored:
-        # If something misses __id (shouldn't), re-add
-        if "__id" not in r or not str(r.get("__id")):
-            r["__id"] = str(uuid4())
+        # If something misses __id (shouldn't), re-add; ids are compared
+        # without str() downstream, so legacy non-str ids are cast here
+        rid = r.get("__id")
+        if rid is None or rid == "":
+            r["__id"] = uuid4().hex
+        elif not isinstance(rid, str):
+            r["__id"] = str(rid)
         # ensure Total consistent
-        qty = max(1, safe_int(r.get("Qty", 1), 1))
+        qty = max(1, _si(r.get("Qty", 1), 1))
         r["Qty"] = qty
-        r["Total"] = safe_float(r.get("Price", 0)) * qty
+        r["Total"] = r["_line_total"] = _sf(r.get("Price", 0)) * qty
         # remove bundle metadata if any
-        if "_bundle" in r:
-            del r["_bundle"]
-        if "_bundle_src" in r:
-            del r["_bundle_src"]
+        r.pop("_bundle", None)
+        r.pop("_bundle_src", None)
 
     st.session_state["inv_items"] = new_items + restored
+    bump_items_version()
     invalidate_pdf()
     st.toast("Bundling reverted.", icon="↩️")
 
@@ -478,8 +551,28 @@ def _sync_payment_terms_from_ui() -> None:
     
     st.session_state["payment_terms"] = terms
 
+# Invoice meta fields copied verbatim from session state by both the PDF
+# and the save path: (meta key, session key, default)
+_META_KEYS = (
+    ("inv_no", "inv_no", ""),
+    ("client_name", "inv_client_name", ""),
+    ("wedding_date", "inv_wedding_date", ""),
+    ("venue", "inv_venue", ""),
+    ("hours", "inv_hours", ""),
+    ("terms", "inv_terms", ""),
+    ("bank_name", "bank_nm", ""),
+    ("bank_acc", "bank_ac", ""),
+    ("bank_holder", "bank_an", ""),
+    ("notes", "inv_notes", ""),
+)
+
+def _meta_snapshot() -> Dict[str, Any]:
+    ss = st.session_state
+    return {mk: ss.get(sk, d) for mk, sk, d in _META_KEYS}
+
 def handle_save_history(inv_no: str, is_update: bool = False) -> None:
     """Save invoice to database history with PDF blob."""
+    start_request_clock()  # on_click runs before render_page starts a scope
     try:
         # Retrieve context from session state
         client_email = st.session_state.get("inv_client_email", "")
@@ -494,45 +587,31 @@ def handle_save_history(inv_no: str, is_update: bool = False) -> None:
             st.session_state["inv_no"] = inv_no
             st.toast(f"Generated Invoice No: {inv_no}", icon="🔢")
 
-        # 0. Normalize pdf_bytes to raw bytes
-        pdf_blob = None
-        if pdf_bytes:
-            if hasattr(pdf_bytes, 'read'):
-                pdf_bytes.seek(0)
-                pdf_blob = pdf_bytes.read()
-            elif isinstance(pdf_bytes, (bytes, bytearray)):
-                pdf_blob = bytes(pdf_bytes)
+        # 0. Stored as raw bytes by collect_pdf_render
+        pdf_blob = pdf_bytes or None
         
         # 1. Gather Data
-        meta = {
-            "inv_no": st.session_state.get("inv_no", ""),
-            "title": st.session_state.get("inv_title", ""),
-            "date": datetime.now().strftime("%d %B %Y"),
-            "client_name": st.session_state.get("inv_client_name", ""),
-            "client_phone": st.session_state.get("inv_client_phone", ""),
+        ss = st.session_state
+        meta = _meta_snapshot()
+        meta.update({
+            "title": ss.get("inv_title", ""),
+            "date": request_today_str(),
+            "client_phone": ss.get("inv_client_phone", ""),
             "client_email": client_email,
-            "wedding_date": st.session_state.get("inv_wedding_date", ""),
-            "venue": st.session_state.get("inv_venue", ""),
-            "hours": st.session_state.get("inv_hours", ""),
             "subtotal": 0,
-            "cashback": safe_float(st.session_state.get("inv_cashback", 0)),
-            "payment_terms": st.session_state.get("payment_terms", []),
-            "terms": st.session_state.get("inv_terms", ""),
-            "bank_name": st.session_state.get("bank_nm", ""),
-            "bank_acc": st.session_state.get("bank_ac", ""),
-            "bank_holder": st.session_state.get("bank_an", ""),
-            "payment_proof": st.session_state.get("pp_cached") or [],
-            "footer_info": [x.strip() for x in str(st.session_state.get("inv_footer", "")).split("\n") if x.strip()],
-            "wa_template": st.session_state.get("wa_template", ""), # ADDED: Save custom WA template
-            "notes": st.session_state.get("inv_notes", "")
-        }
+            "cashback": safe_float(ss.get("inv_cashback", 0)),
+            "payment_terms": ss.get("payment_terms", []),
+            "payment_proof": ss.get("pp_cached") or [],
+            "footer_info": _footer_info(),
+            "wa_template": ss.get("wa_template", ""), # ADDED: Save custom WA template
+        })
 
         # Date is already string now, no formatting needed
         # w_date = st.session_state.get("inv_wedding_date")
         
         # Recalc Totals for DB
         items = st.session_state.get("inv_items", [])
-        sub, grand = calculate_totals(items, meta["cashback"])
+        sub, grand = cart_totals(meta["cashback"])  # subtotal reused from render
         meta["subtotal"] = sub
         
         payload = {
@@ -549,9 +628,9 @@ def handle_save_history(inv_no: str, is_update: bool = False) -> None:
                 edit_id,
                 inv_no, 
                 meta["client_name"], 
-                date.today().strftime("%Y-%m-%d"), 
+                request_now().date(), 
                 grand, 
-                json.dumps(payload),
+                _dumps_payload(payload),
                 pdf_blob=pdf_blob
             )
             st.toast("Updated! Redirecting to History...", icon="✅")
@@ -561,9 +640,9 @@ def handle_save_history(inv_no: str, is_update: bool = False) -> None:
             db.save_invoice(
                 inv_no, 
                 meta["client_name"], 
-                date.today().strftime("%Y-%m-%d"), 
+                request_now().date(), 
                 grand, 
-                json.dumps(payload),
+                _dumps_payload(payload),
                 pdf_blob=pdf_blob
             )
             st.toast("Invoice saved! Redirecting to History...", icon="💾")
@@ -573,8 +652,7 @@ def handle_save_history(inv_no: str, is_update: bool = False) -> None:
             if not st.session_state.get("editing_invoice_id"):
                 # Try parse numeric part from inv_no (e.g. INV00123)
                 # This ensures next person gets INV00124
-                import re
-                m = re.search(r'(\d+)', inv_no)
+                m = _INV_DIGITS_RE.search(inv_no)
                 if m:
                     used_num = int(m.group(1))
                     db.update_global_sequence_if_needed(used_num)
@@ -591,44 +669,106 @@ def handle_save_history(inv_no: str, is_update: bool = False) -> None:
         st.error(f"Failed to save/update history: {e}")
         st.code(traceback.format_exc())  # Show stack trace for debugging
 
+# Shared by all sessions: ReportLab renders off the script thread, so the
+# rerun that started it (and later edits) are not blocked by the build.
+# Each session holds at most one worker at a time (see pdf_render_pending).
+_PDF_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix="pdf")
+
+def _render_pdf(meta: Dict[str, Any], items: List[Dict[str, Any]], grand_total: float) -> bytes:
+    # Lazy Import for Performance (Load bulky PDF libs only when needed)
+    from modules import invoice as invoice_mod
+    pdf_bytes = invoice_mod.generate_pdf_bytes(meta, items, grand_total)
+
+    # Normalize the BytesIO once here; download/save then reuse plain bytes
+    if hasattr(pdf_bytes, "getvalue"):
+        pdf_bytes = pdf_bytes.getvalue()
+    if not pdf_bytes:
+        raise ValueError("PDF Generator returned empty data.")
+    return pdf_bytes
+
+def _pdf_content_key(meta: Dict[str, Any], items: List[Dict[str, Any]], grand_total: float):
+    """Digest of everything the PDF is rendered from; None if not serializable."""
+    try:
+        raw = _dumps_payload({"meta": meta, "items": items, "grand_total": grand_total})
+    except (TypeError, ValueError):
+        return None
+    return hashlib.blake2b(raw.encode(), digest_size=16).digest()
+
+def pdf_render_pending() -> bool:
+    """True while this session's render, or a superseded one still running
+    after invalidate_pdf(), occupies a worker."""
+    ss = st.session_state
+    for k in ("_pdf_future", "_pdf_busy"):
+        fut = ss.get(k)
+        if fut is not None and not fut.done():
+            return True
+    return False
+
+def collect_pdf_render() -> None:
+    """Moves a finished background render into generated_pdf_bytes.
+
+    invalidate_pdf() drops _pdf_future, so a render whose inputs were edited
+    meanwhile is discarded instead of shown.
+    """
+    ss = st.session_state
+    busy = ss.get("_pdf_busy")
+    if busy is not None and busy.done():
+        ss.pop("_pdf_busy", None)  # superseded render finished; result unused
+    fut = ss.get("_pdf_future")
+    if fut is None or not fut.done():
+        return
+    ss.pop("_pdf_future", None)
+    try:
+        ss["generated_pdf_bytes"] = pdf_bytes = fut.result()
+        # Remembered past invalidate_pdf(): regenerating identical input reuses it
+        ss["_pdf_last"] = (ss.pop("_pdf_future_key", None), pdf_bytes)
+        st.toast("PDF Generated Successfully!", icon="✅")
+    except Exception as e:
+        ss["generated_pdf_bytes"] = None
+        st.error(f"Error generating PDF: {e}")
+
 def action_generate_pdf(subtotal: float, grand_total: float) -> None:
     try:
         # Sync UI first!
         _sync_payment_terms_from_ui()
 
-        meta = {
-            "inv_no": st.session_state.get("inv_no", ""),
-            "title": st.session_state.get("inv_title", "Invoice"),
-            "date": datetime.now().strftime("%d %B %Y"),
-            "client_name": st.session_state.get("inv_client_name", ""),
-            "wedding_date": st.session_state.get("inv_wedding_date", ""),
-            "venue": st.session_state.get("inv_venue", ""),
-            "hours": st.session_state.get("inv_hours", ""),
+        ss = st.session_state
+        meta = _meta_snapshot()
+        meta.update({
+            "title": ss.get("inv_title", "Invoice"),
+            "date": request_today_str(),
             "subtotal": subtotal,
-            "cashback": st.session_state.get("inv_cashback", 0),
-            "payment_terms": st.session_state.get("payment_terms", []),
-            "terms": st.session_state.get("inv_terms", ""),
-            "bank_name": st.session_state.get("bank_nm", ""),
-            "notes": st.session_state.get("inv_notes", ""),
-            "bank_acc": st.session_state.get("bank_ac", ""),
-            "bank_holder": st.session_state.get("bank_an", ""),
-            "payment_proof": st.session_state.get("pp_cached") or [],
-            "footer_info": [x.strip() for x in str(st.session_state.get("inv_footer", "")).split("\n") if x.strip()]
-        }
+            "cashback": ss.get("inv_cashback", 0),
+            "payment_terms": ss.get("payment_terms", []),
+            "payment_proof": ss.get("pp_cached") or [],
+            "footer_info": _footer_info()
+        })
         
         # Date is already string
         # w_date = st.session_state.get("inv_wedding_date")
 
-        with st.spinner("Generating PDF..."):
-            # Lazy Import for Performance (Load bulky PDF libs only when needed)
-            from modules import invoice as invoice_mod
-            pdf_bytes = invoice_mod.generate_pdf_bytes(meta, st.session_state["inv_items"], grand_total)
+        content_key = _pdf_content_key(meta, ss["inv_items"], grand_total)
+        if pdf_render_pending():
+            fut = ss.get("_pdf_future")
+            if fut is not None and not fut.done() and ss.get("_pdf_future_key") == content_key:
+                return  # Same input already rendering
+            # One worker per session: wait for the running render to finish
+            invalidate_pdf()
+            st.toast("Previous PDF is still rendering — try again in a moment.", icon="⏳")
+            return
 
-        if not pdf_bytes:
-            raise ValueError("PDF Generator returned empty data.")
+        invalidate_pdf()
+        last = ss.get("_pdf_last")
+        if content_key is not None and last and last[0] == content_key:
+            ss["generated_pdf_bytes"] = last[1]
+            st.toast("PDF unchanged — reusing cache", icon="♻️")
+            return
 
-        st.session_state["generated_pdf_bytes"] = pdf_bytes
-        st.toast("PDF Generated Successfully!", icon="✅")
+        # Deep copies: the worker must not see edits made while it renders
+        ss["_pdf_future_key"] = content_key
+        ss["_pdf_future"] = _PDF_POOL.submit(
+            _render_pdf, copy.deepcopy(meta), copy.deepcopy(ss["inv_items"]), grand_total
+        )
 
     except Exception as e:
         st.session_state["generated_pdf_bytes"] = None
@@ -1,5 +1,4 @@
 # main.py
-import time
 import streamlit as st
 from config import settings, theme
 
@@ -14,7 +13,6 @@ st.set_page_config(
 
 # Imports after page_config
 from modules import auth, db
-from modules import auth, db
 from modules.invoice_state import load_packages_cached, get_dashboard_stats_cached, get_config_cached, get_package_version_cached
 from views import packages_view, invoice_view, history_view, analytics_view
 from views.db_status import render_db_status
@@ -52,8 +50,8 @@ def show_factory_reset_dialog():
     with c2:
         if st.button("💣 Delete All", type="primary", disabled=(confirm != "CONFIRM"), use_container_width=True):
             db.delete_all_packages()
-            st.success("System reset successful.")
-            time.sleep(1.0)
+            # Toast survives the rerun; no server-side sleep needed
+            st.toast("System reset successful.", icon="✅")
             st.rerun()
 
 def render_sidebar() -> str:
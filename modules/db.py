@@ -5,12 +5,21 @@ import streamlit as st
 import json
 from abc import ABC, abstractmethod
 from typing import Optional, List, Dict, Any
-from datetime import datetime
+from datetime import datetime, date
+
+# Bind date parameters as ISO strings (adapters match exact types, so
+# datetime keeps sqlite3's default binding)
+sqlite3.register_adapter(date, date.isoformat)
 
 # --- Helper: Robust Date Normalizer ---
 def _normalize_date_str(s: str) -> str:
     if not s:
         return s
+    # Fast path: date objects need no parsing
+    if isinstance(s, datetime):
+        s = s.date()
+    if isinstance(s, date):
+        return s.isoformat()
     s = str(s).strip()
 
     # format umum
@@ -88,6 +97,15 @@ class DatabaseAdapter(ABC):
     def get_config(self, key: str, default: Optional[str] = None) -> Optional[str]:
         pass
         
+    def get_configs(self, keys: List[str]) -> Dict[str, str]:
+        """Values for the keys present in app_config (missing keys omitted)."""
+        out = {}
+        for k in keys:
+            v = self.get_config(k)
+            if v is not None:
+                out[k] = v
+        return out
+
     @abstractmethod
     def set_config(self, key: str, value: str) -> None:
         pass
@@ -239,6 +257,19 @@ class SQLiteAdapter(DatabaseAdapter):
             print(f"[SQLite] get_config failed: {e}")
             return default
 
+    def get_configs(self, keys: List[str]) -> Dict[str, str]:
+        if not keys:
+            return {}
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                placeholders = ",".join("?" * len(keys))
+                cursor.execute(f"SELECT key, value FROM app_config WHERE key IN ({placeholders})", tuple(keys))
+                return {row['key']: row['value'] for row in cursor.fetchall()}
+        except Exception as e:
+            print(f"[SQLite] get_configs failed: {e}")
+            return {}
+
     def set_config(self, key: str, value: str) -> None:
         try:
             with self._connect() as conn:
@@ -632,6 +663,7 @@ class SQLiteAdapter(DatabaseAdapter):
             c = conn.cursor()
             c.execute("DELETE FROM packages")
             conn.commit()
+        bump_package_version()
 
     def is_db_empty(self) -> bool:
         try:
@@ -717,6 +749,18 @@ class PostgresAdapter(DatabaseAdapter):
             print(f"[Postgres] get_config failed: {e}")
             return default
 
+    def get_configs(self, keys: List[str]) -> Dict[str, str]:
+        if not keys:
+            return {}
+        try:
+            with self._connect() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT key, value FROM app_config WHERE key = ANY(%s)", (list(keys),))
+                    return {row[0]: row[1] for row in cursor.fetchall()}
+        except Exception as e:
+            print(f"[Postgres] get_configs failed: {e}")
+            return {}
+
     def set_config(self, key: str, value: str) -> None:
         try:
             with self._connect() as conn:
@@ -856,6 +900,7 @@ class PostgresAdapter(DatabaseAdapter):
                         (name, price, category, description)
                     )
                 conn.commit()
+            bump_package_version()
         except Exception as e:
             print(f"[DB] Postgres add_package failed: {e}")
 
@@ -869,6 +914,7 @@ class PostgresAdapter(DatabaseAdapter):
                         WHERE id = %s
                     """, (name, price, category, description, package_id))
                 conn.commit()
+            bump_package_version()
         except Exception as e:
             print(f"[DB] Postgres update_package failed: {e}")
 
@@ -878,6 +924,7 @@ class PostgresAdapter(DatabaseAdapter):
                 with conn.cursor() as c:
                     c.execute('DELETE FROM packages WHERE id = %s', (package_id,))
                 conn.commit()
+            bump_package_version()
         except Exception as e:
             print(f"[DB] Postgres delete_package failed: {e}")
 
@@ -888,6 +935,7 @@ class PostgresAdapter(DatabaseAdapter):
                     val = 1 if is_active else 0
                     c.execute("UPDATE packages SET is_active = %s WHERE id = %s", (val, package_id))
                 conn.commit()
+            bump_package_version()
         except Exception as e:
             print(f"[DB] Postgres toggle_package_status failed: {e}")
 
@@ -897,6 +945,7 @@ class PostgresAdapter(DatabaseAdapter):
                 with conn.cursor() as c:
                     c.execute("TRUNCATE TABLE packages RESTART IDENTITY;")
                 conn.commit()
+            bump_package_version()
         except Exception as e:
             print(f"[DB] Postgres delete_all_packages failed: {e}")
 
@@ -1188,6 +1237,10 @@ def get_adapter_type() -> str:
 def get_config(key: str, default: Optional[str] = None) -> Optional[str]:
     return current_db.get_config(key, default)
 
+def get_configs(keys: List[str]) -> Dict[str, str]:
+    """Batch get_config: one query for several keys (missing keys omitted)."""
+    return current_db.get_configs(keys)
+
 def set_config(key: str, value: str) -> None:
     current_db.set_config(key, value)
 
@@ -1,10 +1,12 @@
+import re
 import streamlit as st
 from datetime import datetime, date, timedelta
-from typing import Any, Dict, List, Optional
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
 from uuid import uuid4
 
 from modules import db
-from modules.utils import normalize_db_records
+from modules.utils import normalize_db_records, safe_float, desc_lines_cached, calculate_totals
 
 # --- Constants ---
 DEFAULT_INVOICE_TITLE = "Wedding Invoice"
@@ -29,28 +31,109 @@ DEFAULT_FOOTER_ITEMS = (
 
 CATALOG_CACHE_TTL_SEC = 300
 
+# Keys seeded by initialize_session_state() (keep in sync with its defaults)
+_SESSION_DEFAULT_KEYS = frozenset({
+    "inv_items", "inv_cashback", "generated_pdf_bytes",
+    "inv_title", "inv_client_name", "inv_client_phone", "inv_client_email",
+    "inv_wedding_date", "inv_venue", "payment_terms", "pp_cached",
+    "inv_terms", "bank_nm", "bank_ac", "bank_an", "inv_footer",
+    "editing_invoice_id", "uploader_key",
+})
+
+# --- Request Clock ---
+
+def start_request_clock() -> None:
+    """Starts a new scope for request_now(); call once per rerun/callback."""
+    st.session_state.pop("_now_t", None)
+
+def request_now() -> datetime:
+    """datetime.now(), taken once per scope and reused by later callers."""
+    t = st.session_state.get("_now_t")
+    if t is None:
+        t = st.session_state["_now_t"] = datetime.now()
+    return t
+
+@lru_cache(maxsize=4)
+def _fmt_invoice_date(d: date) -> str:
+    return d.strftime("%d %B %Y")
+
+def request_today_str() -> str:
+    """request_now() as the invoice date string ("20 October 2026"),
+    formatted once per calendar day."""
+    return _fmt_invoice_date(request_now().date())
+
 # --- State Helpers ---
 
 def invalidate_pdf():
     """Invalidates the generated PDF so it is regenerated on next render."""
-    st.session_state["generated_pdf_bytes"] = None
+    ss = st.session_state
+    # Most callers fire per keystroke with no PDF built yet: skip the writes
+    if ss.get("generated_pdf_bytes") is not None:
+        ss["generated_pdf_bytes"] = None
+    ss.pop("_dl_cache", None)
+    fut = ss.pop("_pdf_future", None)  # stale background render (see action_generate_pdf)
+    if fut is not None and not fut.cancel() and not fut.done():
+        # Already running (cancel() can't stop it): keep it so the session
+        # starts no second render until this one frees its worker
+        ss["_pdf_busy"] = fut
+
+def bump_items_version(structural: bool = True) -> None:
+    """Marks inv_items as changed; call from every cart mutation.
+
+    Pass structural=False for in-place edits (qty/price) that keep item
+    order, so the id index in controllers.invoice_callbacks stays valid.
+    """
+    ss = st.session_state
+    ss["_items_version"] = ss.get("_items_version", 0) + 1
+    if structural:
+        ss["_items_struct_version"] = ss.get("_items_struct_version", 0) + 1
+
+def items_version() -> int:
+    """Cache key for values derived from inv_items (see render_pos_section)."""
+    return st.session_state.get("_items_version", 0)
+
+def cart_totals(cashback: float) -> Tuple[float, float]:
+    """calculate_totals() for inv_items; the subtotal is reused until the cart
+    changes, so cashback/metadata reruns skip the per-item sum."""
+    ss = st.session_state
+    items = ss.get("inv_items", [])
+    key = (id(items), items_version())
+    cached = ss.get("_subtotal")
+    if cached is None or cached[0] != key:
+        cached = (key, calculate_totals(items, 0.0)[0])
+        ss["_subtotal"] = cached
+    subtotal = cached[1]
+    return subtotal, max(0.0, subtotal - max(0.0, cashback))
 
 @st.cache_data(show_spinner=False, ttl=CATALOG_CACHE_TTL_SEC)
 def load_db_settings() -> Dict[str, Any]:
+    # One app_config query for all defaults instead of one per key
+    conf = db.get_configs([
+        "inv_title_default", "inv_terms_default", "bank_nm_default", "bank_ac_default",
+        "bank_an_default", "inv_footer_default", "wa_template_default",
+    ])
     return {
-        "title": db.get_config("inv_title_default", DEFAULT_INVOICE_TITLE),
-        "terms": db.get_config("inv_terms_default", DEFAULT_TERMS),
-        "bank_nm": db.get_config("bank_nm_default", DEFAULT_BANK_INFO["bank_nm"]),
-        "bank_ac": db.get_config("bank_ac_default", DEFAULT_BANK_INFO["bank_ac"]),
-        "bank_an": db.get_config("bank_an_default", DEFAULT_BANK_INFO["bank_an"]),
-        "inv_footer": db.get_config("inv_footer_default", DEFAULT_FOOTER_ITEMS),
+        "title": conf.get("inv_title_default", DEFAULT_INVOICE_TITLE),
+        "terms": conf.get("inv_terms_default", DEFAULT_TERMS),
+        "bank_nm": conf.get("bank_nm_default", DEFAULT_BANK_INFO["bank_nm"]),
+        "bank_ac": conf.get("bank_ac_default", DEFAULT_BANK_INFO["bank_ac"]),
+        "bank_an": conf.get("bank_an_default", DEFAULT_BANK_INFO["bank_an"]),
+        "inv_footer": conf.get("inv_footer_default", DEFAULT_FOOTER_ITEMS),
+        "wa_template": conf.get("wa_template_default"),
     }
 
 @st.cache_data(show_spinner=False, ttl=CATALOG_CACHE_TTL_SEC)
 def load_packages_cached(version_key: str) -> List[Dict[str, Any]]:
     # version_key is just for invalidation (not used in function)
     raw = db.load_packages()
-    return normalize_db_records(raw)
+    records = normalize_db_records(raw)
+    # Derived fields for the sidebar/catalog, computed once per cache miss
+    # instead of per card on every rerun.
+    for r in records:
+        r["_name_lc"] = str(r.get("name", "")).lower()
+        r["_price_f"] = safe_float(r.get("price", 0))
+        r["_desc_lines"] = desc_lines_cached(str(r.get("description") or ""))
+    return records
 
 @st.cache_data(show_spinner=False, ttl=10)  # Short TTL for dashboard stats (10s)
 def get_dashboard_stats_cached() -> Dict[str, Any]:
@@ -86,6 +169,13 @@ def ensure_invoice_no_exists():
         st.session_state["inv_no"] = f"INV{ts_suffix}"
 
 def initialize_session_state() -> None:
+    # Fast path: defaults only need applying on a session's first run, or
+    # after keys were dropped (reset, widget state cleared on page switch).
+    # issubset() walks the proxy keys once instead of one lookup per key.
+    ss = st.session_state
+    if ss.get("_init_done") and ss.get("inv_no") and _SESSION_DEFAULT_KEYS.issubset(ss.keys()):
+        return
+
     # Load custom defaults from DB
     db_conf = load_db_settings()
 
@@ -110,7 +200,7 @@ def initialize_session_state() -> None:
         "inv_client_phone": "",
         "inv_client_email": "",
         # Default date as string (e.g. "20 October 2026")
-        "inv_wedding_date": (date.today() + timedelta(days=90)).strftime("%d %B %Y"),
+        "inv_wedding_date": _fmt_invoice_date(request_now().date() + timedelta(days=90)),
         "inv_venue": "",
 
         # Payment Schedule - Dynamic terms (min 2: DP + Pelunasan)
@@ -166,13 +256,17 @@ def initialize_session_state() -> None:
         if not pt or not isinstance(pt, list):
              st.session_state["payment_terms"] = defaults["payment_terms"]
 
+    ss["_init_done"] = True
+
 # --- Invoice No Logic ---
 
+_CLIENT_NAME_RE = re.compile(r'[^a-zA-Z0-9]+')
+
+@lru_cache(maxsize=256)
 def _sanitize_client_name(name: str) -> str:
     """Extract clean uppercase identifier from client name."""
-    import re
     # Remove special chars, keep only letters/numbers
-    clean = re.sub(r'[^a-zA-Z0-9]', '', name)
+    clean = _CLIENT_NAME_RE.sub('', name)
     # Take first 12 chars uppercase
     return clean[:12].upper() if clean else ""
 
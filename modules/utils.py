@@ -1,6 +1,23 @@
 import io
+import math
+import re
+from functools import lru_cache
 from typing import Any, List, Dict, Tuple
 
+# --- Optional SIMD base64 encoder ---
+try:
+    import pybase64
+    HAS_PYBASE64 = True
+except ImportError:
+    import base64
+    HAS_PYBASE64 = False
+
+# Entities decoded by normalize_desc_text in one pass (sanitize_text's inverse)
+_HTML_ENTITIES = {"lt": "<", "gt": ">", "amp": "&", "quot": '"', "#x27": "'"}
+_HTML_ENTITY_RE = re.compile("&(" + "|".join(map(re.escape, _HTML_ENTITIES)) + ");")
+# Any <br...> tag (case-insensitive, attributes allowed) becomes a newline
+_BR_TAG_RE = re.compile(r"<br[^>]*>", re.IGNORECASE)
+
 def safe_float(value: Any, default: float = 0.0) -> float:
     try:
         return float(value)
@@ -27,80 +44,71 @@ def normalize_db_records(raw_data: Any) -> List[Dict[str, Any]]:
     return []
 
 def calculate_totals(items: List[Dict[str, Any]], cashback: float, min_qty: int = 1) -> Tuple[float, float]:
-    subtotal = sum(
-        safe_float(item.get("Price", 0)) * max(min_qty, safe_int(item.get("Qty", 1), 1))
+    # Cart mutators keep _line_total current; items from older saved
+    # invoices don't have it and are computed from Price/Qty instead.
+    subtotal = math.fsum(
+        item["_line_total"] if "_line_total" in item
+        else safe_float(item.get("Price", 0)) * max(min_qty, safe_int(item.get("Qty", 1), 1))
         for item in items
     )
     grand_total = max(0.0, subtotal - max(0.0, cashback))
     return subtotal, grand_total
 
+# Single-pass escape table (translate never re-escapes its own "&amp;")
+_HTML_ESCAPE_TABLE = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;", "'": "&#x27;"})
+
+@lru_cache(maxsize=4096)
+def _sanitize_str(s: str) -> str:
+    return s.translate(_HTML_ESCAPE_TABLE)
+
 def sanitize_text(text: Any) -> str:
-    """Tiny HTML escape w/o imports."""
-    s = str(text or "")
-    s = s.replace("&", "&amp;")
-    s = s.replace("<", "&lt;").replace(">", "&gt;")
-    s = s.replace('"', "&quot;").replace("'", "&#x27;")
-    return s
+    """Tiny HTML escape w/o imports (memoized: the same names repeat every rerun)."""
+    return _sanitize_str(str(text or ""))
 
 def desc_to_lines(desc_clean: str) -> List[str]:
-    lines: List[str] = []
-    for raw in (desc_clean or "").split("\n"):
-        s = str(raw).strip()
-        if not s:
-            continue
-        s = s.lstrip("-•·").strip()
-        if s:
-            lines.append(s)
-    return lines
+    # Leading bullets only: inner "-" (e.g. "H-7") must survive
+    return [s for s in (raw.strip().lstrip("-•·").strip() for raw in (desc_clean or "").split("\n")) if s]
+
+@lru_cache(maxsize=1024)
+def desc_lines_cached(description: str) -> Tuple[str, ...]:
+    """normalize_desc_text + desc_to_lines, memoized per description text."""
+    return tuple(desc_to_lines(normalize_desc_text(description)))
 
 def normalize_desc_text(raw: Any) -> str:
     s = str(raw or "")
-    s = s.replace("&lt;", "<").replace("&gt;", ">")
-    out = []
-    i = 0
-    n = len(s)
-    while i < n:
-        if s[i] == "<" and i + 2 < n and s[i:i+3].lower() == "<br":
-            j = i + 3
-            while j < n and s[j] != ">":
-                j += 1
-            if j < n and s[j] == ">":
-                out.append("\n")
-                i = j + 1
-                continue
-        out.append(s[i])
-        i += 1
-
-    s = "".join(out)
+    s = _HTML_ENTITY_RE.sub(lambda m: _HTML_ENTITIES[m.group(1)], s)
+    s = _BR_TAG_RE.sub("\n", s)
     s = s.replace("\r\n", "\n").replace("\r", "\n")
     return s.strip()
 
+# local@domain.tld: no whitespace, single "@", dotted domain w/o empty labels
+_EMAIL_RE = re.compile(r"[^\s@.]+(?:\.[^\s@.]+)*@[^\s@.]+(?:\.[^\s@.]+)+")
+
 def is_valid_email(email: str) -> bool:
     e = (email or "").strip()
-    if not e or " " in e or "@" not in e:
-        return False
-    local, domain = e.rsplit("@", 1)
-    if not local or not domain or "." not in domain:
-        return False
-    if domain.startswith(".") or domain.endswith(".") or ".." in e:
-        return False
-    return True
+    return _EMAIL_RE.fullmatch(e) is not None
 
-import re
+_UNSAFE_FILENAME_RE = re.compile(r'[<>:"/\\|?*]')
 
+@lru_cache(maxsize=64)
 def make_safe_filename(inv_no: str, prefix: str = "INV") -> str:
     inv_no = (inv_no or prefix).strip()
     # Replace slashes/backslashes but keep spaces
     s = inv_no.replace("/", "_").replace("\\", "_")
     # Remove unsafe filesystem chars (keep space)
-    s = re.sub(r'[<>:"/\\|?*]', '', s)
+    s = _UNSAFE_FILENAME_RE.sub('', s)
     return s.strip() or "invoice"
 
+def b64encode_str(data) -> str:
+    """base64 text for a bytes-like object (pybase64 if installed)."""
+    if HAS_PYBASE64:
+        return pybase64.b64encode_as_string(data)
+    return base64.b64encode(data).decode()
+
 def image_to_base64(uploaded_file) -> str:
     """Converts uploaded file to optimized base64 string (JPEG, resized)."""
     try:
         from PIL import Image
-        import base64
         
         image = Image.open(uploaded_file)
         
@@ -116,17 +124,21 @@ def image_to_base64(uploaded_file) -> str:
         # Save to buffer as JPEG
         buf = io.BytesIO()
         image.save(buf, format="JPEG", quality=85, optimize=True)
-        return base64.b64encode(buf.getvalue()).decode()
+        # getbuffer(): encode straight from the buffer, no bytes copy
+        return b64encode_str(buf.getbuffer())
         
     except Exception as e:
         # Fallback to raw if PIL fails
         try:
-             import base64
-             return base64.b64encode(uploaded_file.getvalue()).decode()
+             return b64encode_str(uploaded_file.getbuffer())
         except:
              return ""
 
+@lru_cache(maxsize=2048)
+def _format_rupiah(val: float) -> str:
+    return f"Rp {val:,.0f}".replace(",", ".")
+
 def rupiah(value: Any) -> str:
     """Formats number as Indonesian Rupiah (e.g. Rp 1.000.000)."""
-    val = safe_float(value)
-    return f"Rp {val:,.0f}".replace(",", ".")
+    # Cart prices/totals repeat across reruns; cache on the parsed float
+    return _format_rupiah(safe_float(value))
@@ -8,7 +8,10 @@ import altair as alt
 from datetime import datetime, date
 from typing import List, Dict, Optional, Any
 
-from modules import db, pdf_report
+from modules import db
+# pdf_report (ReportLab) is imported inside the report helpers below, so
+# loading the dashboard does not pull in the PDF stack.
+from modules.invoice_state import bump_items_version
 from ui.formatters import rupiah
 from services.analytics_service import get_cell_color, parse_date_safe
 from services.analytics_agg import (
@@ -33,6 +36,7 @@ def _get_yearly_report_pdf(year: int) -> Optional[bytes]:
         if not data:
             return None
         chart_data = db.get_analytics_revenue_trend(year)
+        from modules import pdf_report
         return pdf_report.generate_yearly_report(data, year, chart_data=chart_data).getvalue()
     except Exception as e:
         print(f"[Analytics] Yearly report error: {e}")
@@ -45,6 +49,7 @@ def _get_monthly_report_pdf(year: int, month: int) -> Optional[bytes]:
         data = db.get_monthly_report_data(year, month)
         if not data:
             return None
+        from modules import pdf_report
         return pdf_report.generate_monthly_report(data, year, month).getvalue()
     except Exception as e:
         print(f"[Analytics] Monthly report error: {e}")
@@ -501,12 +506,11 @@ def render_quick_jump(bookings_curr: List[Dict]) -> None:
             st.info("No events in this month.")
             selected_evt_id = None
         else:
+            # id -> label built once; format_func is called per option
+            evt_labels = {b["id"]: f"📅 {b['date_str']} | {b['client_name']}" for b in sorted_evts}
             selected_evt_id = st.selectbox("Select Event",
-                options=[b["id"] for b in sorted_evts],
-                format_func=lambda x: next(
-                    (f"📅 {b['date_str']} | {b['client_name']}" for b in sorted_evts if b["id"] == x),
-                    "Unknown"
-                ),
+                options=list(evt_labels),
+                format_func=lambda x: evt_labels.get(x, "Unknown"),
                 key="quick_nav_evt")
 
         st.markdown("") # Spacer
@@ -530,6 +534,7 @@ def _handle_quick_edit(invoice_id: int) -> None:
 
         # Restore basic fields
         st.session_state["inv_items"] = payload.get("items", [])
+        bump_items_version()
         st.session_state["inv_no"] = meta.get("inv_no", "")
         st.session_state["inv_title"] = meta.get("title", "")
         st.session_state["inv_client_name"] = meta.get("client_name", "")
@@ -560,7 +565,7 @@ def _handle_quick_edit(invoice_id: int) -> None:
         st.session_state["bank_ac"] = meta.get("bank_acc") or defaults["bank_ac"]
         st.session_state["bank_an"] = meta.get("bank_holder") or defaults["bank_an"]
         st.session_state["inv_footer"] = meta.get("footer") or defaults["inv_footer"]
-        st.session_state["wa_template"] = meta.get("wa_template") or db.get_config("wa_template_default") or ""
+        st.session_state["wa_template"] = meta.get("wa_template") or defaults["wa_template"] or ""
 
         pp = meta.get("payment_proof")
         st.session_state["pp_cached"] = [pp] if pp and not isinstance(pp, list) else (pp or [])
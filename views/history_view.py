@@ -5,6 +5,7 @@ from typing import Optional
 
 from modules import db
 from modules.utils import make_safe_filename
+from modules.invoice_state import bump_items_version
 from views.styles import page_header, inject_styles
 from ui.formatters import rupiah
 
@@ -350,6 +351,7 @@ def _handle_edit(invoice_id: int):
         
         # Restore State
         st.session_state["inv_items"] = payload.get("items", [])
+        bump_items_version()
         st.session_state["inv_no"] = meta.get("inv_no", "")
         st.session_state["inv_title"] = meta.get("title", "")
         st.session_state["inv_client_name"] = meta.get("client_name", "")
@@ -394,11 +396,7 @@ def _handle_edit(invoice_id: int):
         
         st.session_state["inv_footer"] = meta.get("footer") or db_defaults["inv_footer"]
         
-        # Fix WA Template fallback (not in main load_db_settings keys usually)
-        wa_tmpl = meta.get("wa_template")
-        if not wa_tmpl:
-             wa_tmpl = db.get_config("wa_template_default") # Fetch if missing
-        st.session_state["wa_template"] = wa_tmpl
+        st.session_state["wa_template"] = meta.get("wa_template") or db_defaults["wa_template"]
         
         # Payment Proof (Normalize to List)
         pp_data = meta.get("payment_proof")
@@ -1,19 +1,22 @@
 import streamlit as st
 from datetime import datetime, date, time
 import calendar
+import hashlib
+from functools import lru_cache
 from typing import List, Dict, Any, Tuple
-from modules import db
 from modules.utils import (
     sanitize_text, 
     rupiah, 
-    safe_int, 
     safe_float, 
     make_safe_filename,
-    desc_to_lines, 
-    normalize_desc_text
+    desc_lines_cached
 )
 from modules.invoice_state import (
     invalidate_pdf, 
+    items_version,
+    load_db_settings,
+    request_now,
+    start_request_clock,
     DEFAULT_FOOTER_ITEMS,
     CATALOG_CACHE_TTL_SEC
 )
@@ -21,7 +24,8 @@ from views.styles import (
     section, 
     danger_container, 
     render_package_card, 
-    POS_COLUMN_RATIOS
+    POS_COLUMN_RATIOS,
+    POS_GRID_TEMPLATE
 )
 from controllers.invoice_callbacks import (
     cb_update_invoice_no,
@@ -32,13 +36,18 @@ from controllers.invoice_callbacks import (
     cb_fill_remaining_payment,
     cb_merge_selected_from_ui,
     cb_unmerge_bundle,
-    _cart_bundle_items,
-    _cart_non_bundle_items,
+    item_widget_keys,
+    pos_widget_ids,
     action_generate_pdf,
+    pdf_render_pending,
+    collect_pdf_render,
     handle_save_history,
     cb_reset_transaction,
     cb_save_defaults,
-    cb_client_name_changed
+    cb_client_name_changed,
+    cb_wa_template_changed,
+    cb_footer_changed,
+    wa_template_parts
 )
 # --- Constants & Helpers ---
 PAYMENT_STEP = 1_000_000
@@ -54,19 +63,24 @@ except ImportError:
       "Add-ons",
       "Free / Complimentary"
     ]
+_BALANCED_RESULT = ("BALANCED", "Schedule matches Grand Total.", 0)
+
+@lru_cache(maxsize=64)
 def payment_integrity_status(
-    grand_total: float,
+    grand_total: int,
     dp1: int,
     term2: int,
     term3: int,
     full: int,
 ) -> Tuple[str, str, int]:
-    total_scheduled = int(dp1) + int(term2) + int(term3) + int(full)
-    balance = int(grand_total) - total_scheduled
+    """Callers pass already-coerced ints (hashable, so results are memoized;
+    the function is pure, so nothing needs clearing on reset)."""
+    balance = grand_total - (dp1 + term2 + term3 + full)
+    # Most common case first (finalized invoices)
+    if balance == 0 and grand_total > 0:
+        return _BALANCED_RESULT
     if grand_total <= 0:
         return "INFO", "Add items to cart to calculate payments.", balance
-    if balance == 0:
-        return "BALANCED", "Schedule matches Grand Total.", balance
     if balance > 0:
         return "UNALLOCATED", f"{rupiah(balance)} remaining.", balance
     return "OVER", f"{rupiah(abs(balance))} excess.", balance
@@ -79,7 +93,7 @@ def render_event_metadata() -> None:
     # --- HELPER: Date Parsing/Construction ---
     def _parse_date_str(date_str: str):
         """Returns (day_index, month_index, year_index)."""
-        now = datetime.now()
+        now = request_now()
         d_idx, m_idx, y_idx = 0, now.month - 1, 1 # Defaults: Day="-", CurMonth, CurYear (idx 1)
         
         if not date_str:
@@ -191,7 +205,7 @@ def render_event_metadata() -> None:
             
             days = ["-"] + [str(i) for i in range(1, 32)]
             months = list(calendar.month_name)[1:]
-            current_year = datetime.now().year
+            current_year = request_now().year
             years = [current_year - 1] + [current_year + i for i in range(6)]
             
             # Widgets
@@ -289,38 +303,27 @@ def render_event_metadata() -> None:
             default_wa_template = "Halo Kak {nama}!\n\nTerima kasih sudah mempercayakan momen spesial Anda kepada kami.\n\nBerikut detail invoice Anda:\nInvoice {inv_no}\n\nSilakan cek file invoice yang sudah kami kirimkan ya. Jika ada pertanyaan, jangan ragu untuk menghubungi kami.\n\nWarm regards,\nORBIT Team"
             
             if "wa_template" not in st.session_state:
-                st.session_state["wa_template"] = db.get_config("wa_template_default") or default_wa_template
+                st.session_state["wa_template"] = load_db_settings()["wa_template"] or default_wa_template
             
-            st.text_area("WhatsApp Template", key="wa_template", height=200, label_visibility="collapsed")
+            st.text_area("WhatsApp Template", key="wa_template", height=200, label_visibility="collapsed", on_change=cb_wa_template_changed)
             
         with tab_footer:
             st.caption("Contact Info (Satu baris per item)")
             if "inv_footer" not in st.session_state:
-                 st.session_state["inv_footer"] = db.get_config("inv_footer_default", DEFAULT_FOOTER_ITEMS)
+                 st.session_state["inv_footer"] = load_db_settings()["inv_footer"]
             # Auto-repair corrupted text (e.g. replacement characters)
             if "\ufffd" in st.session_state.get("inv_footer", ""):
                 st.session_state["inv_footer"] = DEFAULT_FOOTER_ITEMS
-            st.text_area("Footer Text", key="inv_footer", height=120, on_change=invalidate_pdf, label_visibility="collapsed")
+            st.text_area("Footer Text", key="inv_footer", height=120, on_change=cb_footer_changed, label_visibility="collapsed")
             
         st.write("")
         if st.button("💾 Save as Default", help="Save these settings as new system defaults"):
             cb_save_defaults()
-def render_pos_section(subtotal: float, cashback: float, grand_total: float) -> None:
-    # --- Section: Bill Items ---
-    st.markdown('<div class="sidebar-header"><h3>🛒 Bill Items</h3></div>', unsafe_allow_html=True)
-    st.caption("ℹ️ **Tip:** Checklist 2 item atau lebih untuk menggabungkan (**Merge Bundle**).")
-    st.write("")
-    
-    # 1) Headers (Desktop Only)
-    # responsive grid matching POS_COLUMN_RATIOS
-    # [2.2, 0.8, 0.6, 1.2, 0.5]
-    grid_template = "2.2fr 0.8fr 0.6fr 1.2fr 0.5fr" 
-    
-    st.markdown(
-        f"""
+# POS table header (desktop only); grid matches POS_COLUMN_RATIOS
+_POS_HEADER_HTML = f"""
         <div class="mobile-hidden" style="
             display: grid; 
-            grid-template-columns: {grid_template}; 
+            grid-template-columns: {POS_GRID_TEMPLATE}; 
             gap: 1rem; 
             margin-bottom: 8px; 
             border-bottom: 1px solid #eee;
@@ -334,19 +337,110 @@ def render_pos_section(subtotal: float, cashback: float, grand_total: float) ->
             <div>Total</div>
             <div>Action</div>
         </div>
-        """, 
-        unsafe_allow_html=True
+        """
+
+# Totals boxes under the POS table; only the amount is formatted per run
+_SUBTOTAL_TMPL = """
+        <div style="background:#f8f9fa; padding:12px; border-radius:8px;">
+            <div style='display:flex; justify-content:space-between; '><span>Subtotal</span><span>{0}</span></div>
+        </div>
+        """
+_GRAND_TOTAL_TMPL = """
+        <div style="background:#e3f2fd; padding:12px; border-radius:8px; margin-top:8px; color:#1565c0;">
+            <div style='display:flex; justify-content:space-between; font-weight:700;'><span>Grand Total</span><span>{0}</span></div>
+        </div>
+        """
+
+def _pos_row_cache() -> Dict[str, Dict[str, Any]]:
+    """Per-item derived display data, valid until the cart changes.
+
+    Keyed by items_version(), so reruns from unrelated widgets (cashback,
+    client fields) skip re-parsing every item's details text.
+    """
+    cache = st.session_state.get("_pos_rows")
+    ver = items_version()
+    if cache is None or cache[0] != ver:
+        cache = (ver, {})
+        st.session_state["_pos_rows"] = cache
+    return cache[1]
+
+# Category -> pill class (Synced with views/styles.py .pkg-pill)
+_POS_CAT_CLASS = {
+    "Wedding": "cat-wedding",
+    "Bundling Package": "cat-bundling",
+    "Prewedding": "cat-prewedding",
+    "Engagement/Sangjit": "cat-engagement",
+    "Corporate/Event": "cat-corporate",
+    "Add-ons": "cat-addons",
+    "Free / Complimentary": "cat-free"
+}
+
+def _pos_row_data(item: Dict[str, Any]) -> Dict[str, Any]:
+    icon = "📦" if item.get("_bundle", False) else "🔹"
+    
+    # Category Pill Logic
+    cat = item.get("category", "")
+    pill_html = ""
+    if cat:
+        # Inline style adjustment for vertical align
+        c_cls = _POS_CAT_CLASS.get(cat, "main")
+        pill_html = f'&nbsp;<span class="pkg-pill {c_cls}" style="font-size:0.6rem; padding:1px 6px; margin:0; vertical-align:middle;">{cat}</span>'
+    
+    # Show details text (limit 2-3 lines)
+    details_text = item.get('Details', '')
+    lines = desc_lines_cached(str(details_text)) if details_text else ()
+    parts = [f"**{icon} {item.get('Description', 'Item')}**{pill_html}"]
+    details = "".join(
+        f"<div style='font-size:0.75rem; color:#6b7280; line-height:1.2; margin-left:4px;'>• {line}</div>"
+        for line in lines[:3] # Max 3 lines
     )
+    if len(lines) > 3:
+        details += f"<div style='font-size:0.7rem; color:#9ca3af; margin-left:4px; font-style:italic;'>+ {len(lines)-3} items...</div>"
+    if details:
+        parts.append(details)
+    return {
+        "desc_md": "\n\n".join(parts),
+        # Pre-formatted here (not on the item dict, which is saved to history)
+        "price": rupiah(item.get("Price", 0)),
+        "total": rupiah(item.get("Total", 0)),
+    }
+
+def _toggle_bundle_sel(oid: str) -> None:
+    # Module-level (not a closure per row per rerun); item id passed via args
+    csel = st.session_state.get("bundle_sel", [])
+    # Toggle
+    if oid in csel:
+        csel.remove(oid)
+    else:
+        csel.append(oid)
+    st.session_state["bundle_sel"] = csel
+
+def render_pos_section(subtotal: float, cashback: float, grand_total: float) -> None:
+    # --- Section: Bill Items ---
+    st.markdown('<div class="sidebar-header"><h3>🛒 Bill Items</h3></div>', unsafe_allow_html=True)
+    st.caption("ℹ️ **Tip:** Checklist 2 item atau lebih untuk menggabungkan (**Merge Bundle**).")
+    st.write("")
+    
+    # 1) Headers (Desktop Only)
+    st.markdown(_POS_HEADER_HTML, unsafe_allow_html=True)
     # 2) Items Loop
     items = st.session_state.get("inv_items", [])
+    rows = _pos_row_cache()
+    # Bundle selection as a set once, not a list scan per row
+    sel_set = set(st.session_state.get("bundle_sel", []))
+    rendered_ids = pos_widget_ids()
     if not items:
         st.info("Basket is empty. Select packages from the sidebar.")
     else:
         for idx, item in enumerate(items):
-            item_id = str(item.get("__id"))
+            item_id = item.get("__id")  # str: set at insert / restore
             is_bundle = item.get("_bundle", False)
+            k_sel, k_qty, k_bp, k_unmerge, k_del = item_widget_keys(item_id)
+            rendered_ids.add(item_id)
             
-            bg_style = "background-color: #fcfcfc;" if is_bundle else ""
+            row = rows.get(item_id)
+            if row is None:
+                row = rows[item_id] = _pos_row_data(item)
             
             c1, c2, c3, c4, c5 = st.columns(POS_COLUMN_RATIOS)
             
@@ -358,66 +452,29 @@ def render_pos_section(subtotal: float, cashback: float, grand_total: float) ->
                     is_sel = False
                     if not is_bundle:
                         # Check if this item is in current selection
-                        current_sel = st.session_state.get("bundle_sel", [])
-                        is_sel = (item_id in current_sel)
+                        is_sel = (item_id in sel_set)
                         
-                        def _on_check(oid=item_id):
-                            csel = st.session_state.get("bundle_sel", [])
-                            # Toggle
-                            if oid in csel:
-                                csel.remove(oid)
-                            else:
-                                csel.append(oid)
-                            st.session_state["bundle_sel"] = csel
-                            
                         st.checkbox(
                             "Select", 
-                            key=f"sel_{item_id}", 
+                            key=k_sel, 
                             value=is_sel, 
                             label_visibility="collapsed",
-                            on_change=_on_check
+                            on_change=_toggle_bundle_sel,
+                            args=(item_id,)
                         )
                 
                 with col_desc:
-                    icon = "📦" if is_bundle else "🔹"
-                    
-                    # Category Pill Logic
-                    cat = item.get("category", "")
-                    pill_html = ""
-                    if cat:
-                        cat_map = {
-                            "Wedding": "cat-wedding",
-                            "Bundling Package": "cat-bundling",
-                            "Prewedding": "cat-prewedding",
-                            "Engagement/Sangjit": "cat-engagement",
-                            "Corporate/Event": "cat-corporate",
-                            "Add-ons": "cat-addons",
-                            "Free / Complimentary": "cat-free"
-                        }
-                        # Inline style adjustment for vertical align
-                        c_cls = cat_map.get(cat, "main")
-                        pill_html = f'&nbsp;<span class="pkg-pill {c_cls}" style="font-size:0.6rem; padding:1px 6px; margin:0; vertical-align:middle;">{cat}</span>'
-
-                    st.markdown(f"**{icon} {item.get('Description', 'Item')}**{pill_html}", unsafe_allow_html=True)
-                    
-                    # Show details text (limit 2-3 lines)
-                    details_text = item.get('Details', '')
-                    if details_text:
-                        lines = desc_to_lines(normalize_desc_text(details_text))
-                        for line in lines[:3]: # Max 3 lines
-                             st.markdown(f"<div style='font-size:0.75rem; color:#6b7280; line-height:1.2; margin-left:4px;'>• {line}</div>", unsafe_allow_html=True)
-                        if len(lines) > 3:
-                             st.markdown(f"<div style='font-size:0.7rem; color:#9ca3af; margin-left:4px; font-style:italic;'>+ {len(lines)-3} items...</div>", unsafe_allow_html=True)
+                    # Title + pill + details: one cached markdown per row
+                    st.markdown(row["desc_md"], unsafe_allow_html=True)
                     if is_bundle:
                         # st.caption("Bundled Item") # Replaced by pill
-                        if st.button("Unmerge", key=f"unmerge_{item_id}", help="Revert to original items"):
+                        if st.button("Unmerge", key=k_unmerge, help="Revert to original items"):
                             cb_unmerge_bundle(item_id)
                             st.rerun()
             # Col 2: Price (Editable for Bundles)
             with c2:
                 if is_bundle:
                     # Bundle price logic...
-                    k_bp = f"bundle_price_{item_id}"
                     st.number_input(
                         "Price",
                         value=int(item.get("Price", 0)),
@@ -428,11 +485,10 @@ def render_pos_section(subtotal: float, cashback: float, grand_total: float) ->
                         args=(item_id, k_bp)
                     )
                 else:
-                    st.write(rupiah(item.get("Price", 0)))
+                    st.write(row["price"])
             
             # Col 3: Qty
             with c3:
-                k_qty = f"qty_{item_id}"
                 st.number_input(
                     "Qty", 
                     min_value=1, 
@@ -445,12 +501,12 @@ def render_pos_section(subtotal: float, cashback: float, grand_total: float) ->
                 )
             # Col 4: Total
             with c4:
-                st.write(rupiah(item.get("Total", 0)))
+                st.write(row["total"])
             # Col 5: Delete
             with c5:
                 st.button(
                     "🗑️", 
-                    key=f"del_{item_id}", 
+                    key=k_del, 
                     on_click=cb_delete_item, 
                     args=(item_id,),
                     type="secondary"
@@ -477,16 +533,7 @@ def render_pos_section(subtotal: float, cashback: float, grand_total: float) ->
                     
     with bc2:
         # Totals Display
-        def _row(lbl, val, bold=False):
-            s = "font-weight:700;" if bold else ""
-            return f"<div style='display:flex; justify-content:space-between; {s}'><span>{lbl}</span><span>{val}</span></div>"
-            
-        html_totals = f"""
-        <div style="background:#f8f9fa; padding:12px; border-radius:8px;">
-            {_row("Subtotal", rupiah(subtotal))}
-        </div>
-        """
-        st.markdown(html_totals, unsafe_allow_html=True)
+        st.markdown(_SUBTOTAL_TMPL.format(rupiah(subtotal)), unsafe_allow_html=True)
         
         # Cashback Input
         c_cb = st.number_input(
@@ -499,15 +546,77 @@ def render_pos_section(subtotal: float, cashback: float, grand_total: float) ->
         if c_cb > 0:
             st.caption("ℹ️ *Menggunakan Template Invoice Diskon*")
         
-        html_grand = f"""
-        <div style="background:#e3f2fd; padding:12px; border-radius:8px; margin-top:8px; color:#1565c0;">
-            {_row("Grand Total", rupiah(grand_total), bold=True)}
-        </div>
-        """
-        st.markdown(html_grand, unsafe_allow_html=True)
+        st.markdown(_GRAND_TOTAL_TMPL.format(rupiah(grand_total)), unsafe_allow_html=True)
         
     st.markdown("</div>", unsafe_allow_html=True) # End Section
+def _payment_status_html(grand_total: float, total_alloc: int) -> str:
+    remaining = int(grand_total) - total_alloc
+    
+    # Status Logic
+    if grand_total <= 0:
+        status, msg = "INFO", "Add items to cart to calculate payments."
+    elif remaining == 0:
+        status, msg = "BALANCED", "Payment fully allocated!"
+    elif remaining > 0:
+        status, msg = "UNALLOCATED", f"Remaining: {rupiah(remaining)}"
+    else:
+        status, msg = "OVER", f"Over by: {rupiah(abs(remaining))}"
+    
+    badge_cls = {"BALANCED": "badg-green", "UNALLOCATED": "badg-orange", "OVER": "badg-red", "INFO": "badg-blue"}.get(status, "badg-blue")
+    return f"""
+            <div class="statusbar" style="margin-bottom:16px;">
+              <div>
+                <div class="status-title">Payment Status</div>
+                <div class="muted">{sanitize_text(msg)}</div>
+              </div>
+              <div class="status-right">
+                <span class="iso-badg {badge_cls}">{status}</span>
+              </div>
+            </div>
+            """
+
+def _proof_hashes(proofs: list) -> Tuple[set, set]:
+    """(digests, skipped_names) for the attached proofs, kept session-side in
+    pp_cached_hashes so the proof dicts (saved to history) stay unchanged.
+
+    Rebuilt from the stored base64 whenever pp_cached is replaced or resized
+    outside the uploader (history load, delete, reset); that also covers
+    proofs loaded from history. Uploads add their raw-file digest too.
+    """
+    key = (id(proofs), len(proofs))
+    cached = st.session_state.get("pp_cached_hashes")
+    if cached is None or cached[0] != key:
+        digests = {
+            hashlib.blake2b(str(p.get("b64", "")).encode(), digest_size=16).digest()
+            for p in proofs if isinstance(p, dict)
+        }
+        cached = (key, digests, set())
+        st.session_state["pp_cached_hashes"] = cached
+    return cached[1], cached[2]
+
+def _mark_download_stale() -> None:
+    # A fragment-only rerun doesn't redraw the download section below it
+    if st.session_state.get("generated_pdf_bytes") is not None:
+        st.session_state["_pay_app_rerun"] = True
+
+def _on_payment_edit() -> None:
+    _mark_download_stale()
+    invalidate_pdf()
+
+def _on_fill_remaining(grand_total: float) -> None:
+    _mark_download_stale()
+    cb_fill_remaining_payment(grand_total)
+
+# Payment widgets rerun only this section; cart/catalog edits still rerun
+# the whole app (and this with it, with a fresh grand_total)
+@st.fragment
 def render_payment_section(grand_total: float) -> None:
+    ss = st.session_state  # local alias: read many times per term below
+    if ss.pop("_pay_app_rerun", False):
+        st.rerun(scope="app")
+    # Fragment reruns skip render_page, so open a fresh clock scope here
+    # (proof upload timestamps read request_now())
+    start_request_clock()
     # --- Section: Payment (Unified) ---
     st.markdown('<div class="sidebar-header"><h3>💳 Payment Manager</h3></div>', unsafe_allow_html=True)
     st.caption("🔒 **DP** dan **Pelunasan** terkunci. Tambahkan termin pembayaran sesuai kebutuhan.")
@@ -517,40 +626,18 @@ def render_payment_section(grand_total: float) -> None:
     # === TAB 1: SCHEDULE ===
     with tab_schedule:
         st.write("")
-        terms = st.session_state.get("payment_terms", [])
-        
-        # Calculate Integrity
-        dp1 = safe_int(st.session_state.get("pay_dp1", terms[0]["amount"] if terms else 0))
-        # Sum others dynamically if needed, but here we iterate
-        total_alloc = sum([int(t.get("amount", 0)) for t in terms])
-        remaining = int(grand_total) - total_alloc
+        terms = ss.get("payment_terms", [])
         
-        # Status Logic
-        if grand_total <= 0:
-            status, msg = "INFO", "Add items to cart to calculate payments."
-        elif remaining == 0:
-            status, msg = "BALANCED", "Payment fully allocated!"
-        elif remaining > 0:
-            status, msg = "UNALLOCATED", f"Remaining: Rp {remaining:,.0f}".replace(",", ".")
-        else:
-            status, msg = "OVER", f"Over by: Rp {abs(remaining):,.0f}".replace(",", ".")
+        # Calculate Integrity (single pass over the dynamic terms)
+        total_alloc = sum(int(t.get("amount", 0)) for t in terms)
         
-        badge_cls = {"BALANCED": "badg-green", "UNALLOCATED": "badg-orange", "OVER": "badg-red", "INFO": "badg-blue"}.get(status, "badg-blue")
-        # Status Bar
-        st.markdown(
-            f"""
-            <div class="statusbar" style="margin-bottom:16px;">
-              <div>
-                <div class="status-title">Payment Status</div>
-                <div class="muted">{sanitize_text(msg)}</div>
-              </div>
-              <div class="status-right">
-                <span class="iso-badg {badge_cls}">{status}</span>
-              </div>
-            </div>
-            """,
-            unsafe_allow_html=True,
-        )
+        # Status Bar (rebuilt only when the totals it depends on change)
+        status_key = (grand_total, total_alloc)
+        cached_status = ss.get("_pay_status")
+        if not cached_status or cached_status[0] != status_key:
+            cached_status = (status_key, _payment_status_html(grand_total, total_alloc))
+            ss["_pay_status"] = cached_status
+        st.markdown(cached_status[1], unsafe_allow_html=True)
         # Dynamic Payment Terms UI
         for idx, term in enumerate(terms):
             term_id = term.get("id", f"term_{idx}")
@@ -562,7 +649,7 @@ def render_payment_section(grand_total: float) -> None:
             
             with col_label:
                 k_args = {"value": term.get("label", f"Payment {idx+1}")}
-                if label_key in st.session_state:
+                if label_key in ss:
                      k_args.pop("value", None)
                 
                 st.text_input(
@@ -570,13 +657,13 @@ def render_payment_section(grand_total: float) -> None:
                     key=label_key,
                     label_visibility="collapsed",
                     disabled=is_locked,
-                    on_change=invalidate_pdf,
+                    on_change=_on_payment_edit,
                     **k_args
                 )
             
             with col_amount:
                 n_args = {"value": term.get("amount", 0)}
-                if amt_key in st.session_state:
+                if amt_key in ss:
                      n_args.pop("value", None)
                      
                 st.number_input(
@@ -584,31 +671,32 @@ def render_payment_section(grand_total: float) -> None:
                     step=PAYMENT_STEP,
                     key=amt_key,
                     label_visibility="collapsed",
-                    on_change=invalidate_pdf,
+                    on_change=_on_payment_edit,
                     **n_args
                 )
             
             # Sync widget values back to payment_terms list
-            if label_key in st.session_state and not is_locked:
-                st.session_state["payment_terms"][idx]["label"] = st.session_state[label_key]
-            if amt_key in st.session_state:
-                st.session_state["payment_terms"][idx]["amount"] = int(st.session_state[amt_key])
+            # (term is ss["payment_terms"][idx], mutated in place)
+            if label_key in ss and not is_locked:
+                term["label"] = ss[label_key]
+            if amt_key in ss:
+                term["amount"] = int(ss[amt_key])
             
             with col_action:
                 if is_locked:
                     st.markdown("🔒", help="Required term")
                 elif len(terms) > 2:  # Only allow delete if > 2 terms
                     if st.button("🗑️", key=f"del_term_{term_id}", help="Remove term"):
-                        st.session_state["payment_terms"].pop(idx)
+                        ss["payment_terms"].pop(idx)
                         invalidate_pdf()
                         st.rerun()
                 else:
                     st.write("")  # Empty placeholder
             
             # Show formatted amount caption (from synced value)
-            current_amt = st.session_state.get(amt_key, term.get("amount", 0))
+            current_amt = ss.get(amt_key, term.get("amount", 0))
             if current_amt > 0:
-                st.caption(f"Rp {int(current_amt):,}".replace(",", "."))
+                st.caption(rupiah(int(current_amt)))
         # Add Term Button (max 6 terms)
         # Action Buttons (Compact Layout)
         st.write("")
@@ -621,14 +709,14 @@ def render_payment_section(grand_total: float) -> None:
                     # Insert before Pelunasan (last locked term)
                     pelunasan_idx = next((i for i, t in enumerate(terms) if t.get("id") == "full"), len(terms))
                     new_term = {"id": new_id, "label": f"Payment {len(terms)}", "amount": 0, "locked": False}
-                    st.session_state["payment_terms"].insert(pelunasan_idx, new_term)
+                    ss["payment_terms"].insert(pelunasan_idx, new_term)
                     invalidate_pdf()
                     st.rerun()
         
         with c_act2:
             st.button(
                 "Fill Remaining → Pelunasan",
-                on_click=cb_fill_remaining_payment,
+                on_click=_on_fill_remaining,
                 args=(grand_total,),
                 disabled=(grand_total <= 0),
                 use_container_width=True,
@@ -637,8 +725,8 @@ def render_payment_section(grand_total: float) -> None:
     with tab_proof:
         st.write("")
         
-        current_proofs = st.session_state.get("pp_cached", [])
-        is_editing = st.session_state.get("editing_invoice_id")
+        current_proofs = ss.get("pp_cached", [])
+        is_editing = ss.get("editing_invoice_id")
         
         # 1. ATTACHMENTS LIST - Only show for history (when editing)
         if current_proofs and is_editing:
@@ -651,11 +739,11 @@ def render_payment_section(grand_total: float) -> None:
                     with c2:
                         if st.button("✕", key=f"del_pp_{idx}"):
                             current_proofs.pop(idx)
-                            st.session_state["pp_cached"] = current_proofs
+                            ss["pp_cached"] = current_proofs
                             st.rerun()
             st.divider()
         # 2. UPLOADER (Bottom)
-        uploader_key = f"pp_uploader_{st.session_state.get('uploader_key', 0)}"
+        uploader_key = f"pp_uploader_{ss.get('uploader_key', 0)}"
         pp_files = st.file_uploader(
             "Upload Images (Max 5MB)", 
             type=["jpg", "png", "jpeg"], 
@@ -669,26 +757,45 @@ def render_payment_section(grand_total: float) -> None:
                 current_proofs = []
             
             new_added = False
+            # Uploads persist across reruns, so most files hit the name check;
+            # new names are hashed to catch the same image under another name.
+            known_names = {p.get("name") for p in current_proofs if isinstance(p, dict)}
+            known_digests, skipped_names = _proof_hashes(current_proofs)
             for f in pp_files:
                 if f.size > 5 * 1024 * 1024:
                     st.error(f"❌ '{f.name}' too large.")
                     continue
-                if any(p.get("name") == f.name for p in current_proofs):
+                if f.name in known_names or f.name in skipped_names:
                     continue
-                    
-                from modules.utils import image_to_base64
-                b64 = image_to_base64(f)
-                if b64:
-                    current_proofs.append({
-                        "name": f.name,
-                        "b64": b64,
-                        "date": datetime.now().strftime("%Y-%m-%d %H:%M")
-                    })
-                    new_added = True
-                    st.toast(f"Attached: {f.name}", icon="📎")
+                raw_digest = hashlib.blake2b(f.getbuffer(), digest_size=16).digest()
+                b64 = None
+                if raw_digest not in known_digests:
+                    from modules.utils import image_to_base64
+                    b64 = image_to_base64(f)
+                    if not b64:
+                        continue
+                    # Encoded form matches proofs loaded from history
+                    b64_digest = hashlib.blake2b(b64.encode(), digest_size=16).digest()
+                    if b64_digest in known_digests:
+                        b64 = None
+                if b64 is None:
+                    skipped_names.add(f.name)
+                    st.toast(f"Skipped '{f.name}': same image is already attached.", icon="ℹ️")
+                    continue
+                current_proofs.append({
+                    "name": f.name,
+                    "b64": b64,
+                    "date": request_now().strftime("%Y-%m-%d %H:%M")
+                })
+                known_names.add(f.name)
+                known_digests.update((raw_digest, b64_digest))
+                new_added = True
+                st.toast(f"Attached: {f.name}", icon="📎")
             
             if new_added:
-                st.session_state["pp_cached"] = current_proofs
+                ss["pp_cached"] = current_proofs
+                # Re-key to the grown list so the digests above are kept
+                ss["pp_cached_hashes"] = ((id(current_proofs), len(current_proofs)), known_digests, skipped_names)
                 st.toast("Files attached!", icon="📎")
             
             # Don't reset uploader - let Streamlit's native preview persist
@@ -727,52 +834,64 @@ def render_action_buttons(subtotal: float, grand_total: float) -> None:
     else:
         # Floating Sticky Bottom Action Bar
         st.markdown('<div class="sticky-bottom-actions">', unsafe_allow_html=True)
-        if st.button("📄 Generate Invoice PDF", type="primary", use_container_width=True):
+        # Disabled while a render holds this session's worker
+        if st.button("📄 Generate Invoice PDF", type="primary", use_container_width=True,
+                     disabled=pdf_render_pending()):
             action_generate_pdf(subtotal, grand_total)
         st.markdown('</div>', unsafe_allow_html=True)
+@st.fragment(run_every=0.5)
+def _render_pdf_pending() -> None:
+    # Polls the background render; a full rerun picks up the result
+    if not pdf_render_pending():
+        st.rerun()
+    st.info("⏳ Generating PDF...")
+
 def render_download_section() -> None:
-    pdf_data = st.session_state.get("generated_pdf_bytes")
-    # Clean PDF bytes validation
-    if not pdf_data:
+    if pdf_render_pending():
+        _render_pdf_pending()
         return
-    try:
-        if hasattr(pdf_data, "read"):
-            pdf_data.seek(0)
-            pdf_bytes = pdf_data.read()
-        else:
-            pdf_bytes = pdf_data if isinstance(pdf_data, (bytes, bytearray)) else b""
-    except Exception:
-        pdf_bytes = b""
+    collect_pdf_render()
+    # Plain bytes (normalized once by collect_pdf_render)
+    pdf_bytes = st.session_state.get("generated_pdf_bytes")
     if not pdf_bytes:
         return
     inv_no = str(st.session_state.get("inv_no", "INV"))
-    file_name = f"{make_safe_filename(inv_no, prefix='INV')}.pdf"
-    
-    # Determine Status Suffix (DP / LUNAS)
     payments = st.session_state.get("payment_terms", [])
-    suffix = ""
-    
-    try:
-        # Find "Pelunasan" (id='full')
-        pelunasan = next((t for t in payments if t.get("id") == "full"), None)
-        has_pelunasan = pelunasan and int(float(pelunasan.get("amount", 0))) > 0
-        
-        # Check DP (any term before Full that has amount > 0)
-        has_dp = any(int(float(t.get("amount", 0))) > 0 for t in payments if t.get("id") != "full")
-        
-        if has_pelunasan:
-            # If Pelunasan is filled, it's FULL/LUNAS
-            # Check if there were other terms to distinguish "Direct Full" vs "Final Payment"
-            # But simpler is better: if Pelunasan > 0 -> LUNAS
-            suffix = " LUNAS"
-        elif has_dp:
-            suffix = " DP"
-            
-    except Exception:
-        pass # Fallback to no suffix
-        
-    safe_base = make_safe_filename(inv_no, prefix='INV')
-    file_name = f"{safe_base}{suffix}.pdf"
+
+    # Reuse the derived file name across reruns while the PDF object and the
+    # filename inputs (inv_no + payment amounts) are unchanged.
+    # The cache holds a reference to pdf_bytes, so the identity check is safe.
+    dl_key = (inv_no, tuple((t.get("id"), t.get("amount")) for t in payments))
+    cached = st.session_state.get("_dl_cache")
+    if cached and cached[0] is pdf_bytes and st.session_state.get("_dl_cache_key") == dl_key:
+        _, file_name = cached
+    else:
+        # Determine Status Suffix (DP / LUNAS)
+        suffix = ""
+        try:
+            # Find "Pelunasan" (id='full')
+            pelunasan = next((t for t in payments if t.get("id") == "full"), None)
+            has_pelunasan = pelunasan and int(float(pelunasan.get("amount", 0))) > 0
+            
+            # Check DP (any term before Full that has amount > 0)
+            has_dp = any(int(float(t.get("amount", 0))) > 0 for t in payments if t.get("id") != "full")
+            
+            if has_pelunasan:
+                # If Pelunasan is filled, it's FULL/LUNAS
+                # Check if there were other terms to distinguish "Direct Full" vs "Final Payment"
+                # But simpler is better: if Pelunasan > 0 -> LUNAS
+                suffix = " LUNAS"
+            elif has_dp:
+                suffix = " DP"
+                
+        except Exception:
+            pass # Fallback to no suffix
+            
+        safe_base = make_safe_filename(inv_no, prefix='INV')
+        file_name = f"{safe_base}{suffix}.pdf"
+
+        st.session_state["_dl_cache"] = (pdf_bytes, file_name)
+        st.session_state["_dl_cache_key"] = dl_key
     
     with st.container(border=True):
         st.markdown("<div class='blk-title'>✅ PDF Ready</div>", unsafe_allow_html=True)
@@ -781,7 +900,10 @@ def render_download_section() -> None:
         # REFACTOR: Full Width Download, then 3 actions below
         st.download_button(
             label="⬇️ Download PDF",
-            data=pdf_bytes,
+            # Deferred: the bytes are only handed to the media file manager
+            # on click, not hashed/registered on every rerun. Bound by value
+            # (the callable runs outside the script thread).
+            data=lambda pdf=pdf_bytes: pdf,
             file_name=file_name,
             mime="application/pdf",
             type="primary", 
@@ -819,10 +941,11 @@ def render_download_section() -> None:
                 # Get template
                 raw_tmpl = st.session_state.get("wa_template", "")
                 if not raw_tmpl:
-                        raw_tmpl = db.get_config("wa_template_default") or "Halo {nama}, Invoice {inv_no} sudah ready."
+                    raw_tmpl = load_db_settings()["wa_template"] or "Halo {nama}, Invoice {inv_no} sudah ready."
                 
-                # Replace placeholders
-                msg = raw_tmpl.replace("{nama}", client_name).replace("{inv_no}", inv_no)
+                # Fill placeholders from the pre-split template
+                fields = {"N": client_name, "I": inv_no}
+                msg = "".join(fields[p] if i % 2 else p for i, p in enumerate(wa_template_parts(raw_tmpl)))
                 
                 # Encode
                 import urllib.parse
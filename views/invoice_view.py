@@ -1,8 +1,7 @@
 import streamlit as st
 from datetime import datetime
-from modules.utils import safe_float, calculate_totals
-from modules.utils import safe_float, calculate_totals
-from modules.invoice_state import initialize_session_state, load_packages_cached, get_package_version_cached
+from modules.utils import safe_float
+from modules.invoice_state import initialize_session_state, load_packages_cached, get_package_version_cached, start_request_clock, cart_totals
 from views.styles import inject_styles, page_header
 from views.invoice_components import (
     render_event_metadata,
@@ -20,6 +19,7 @@ from modules import db
 
 def render_page() -> None:
     # 1. Initialize System
+    start_request_clock()
     initialize_session_state()
     # FORCE: Ensure critical state exists even if init logic was cached/skipped
     # Check if empty BEFORE ensuring, so we know if we need to refresh widgets
@@ -51,6 +51,7 @@ def render_page() -> None:
     page_header("🧾 Event Invoice Builder", "Manage sales, split payments, and generate invoices.")
 
     # 4. Data Loading
+    pkg_ver = ""
     try:
         # Smart Caching: Only invalidates when DB version changes
         pkg_ver = get_package_version_cached()
@@ -60,17 +61,14 @@ def render_page() -> None:
         packages = []
 
     # 5. Calculations
-    subtotal, grand_total = calculate_totals(
-        st.session_state["inv_items"],
-        safe_float(st.session_state.get("inv_cashback", 0)),
-    )
+    subtotal, grand_total = cart_totals(safe_float(st.session_state.get("inv_cashback", 0)))
 
     # 6. Layout: Sidebar vs Main
     sidebar_col, main_col = st.columns([1, 3], gap="large")
     
     # --- LEFT SIDEBAR ---
     with sidebar_col:
-        render_sidebar_packages_v2(packages)
+        render_sidebar_packages_v2(packages, pkg_ver)
     
     # --- RIGHT MAIN AREA ---
     with main_col:
@@ -85,7 +83,7 @@ def render_page() -> None:
                     st.session_state["show_catalog"] = False
                     st.rerun()
                 
-                render_full_catalog_content(packages)
+                render_full_catalog_content(packages, pkg_ver)
             st.divider()
 
         # A. Form
@@ -1,6 +1,8 @@
 import streamlit as st
+from typing import List
 from modules import db
-from views.styles import page_header, section, danger_container
+from modules.invoice_state import CATALOG_CACHE_TTL_SEC
+from views.styles import page_header, section, danger_container, render_package_card
 from ui.formatters import rupiah
 from views.styles import inject_styles
 
@@ -84,27 +86,36 @@ def _desc_meta(text: str, max_lines: int = DESC_PREVIEW_LINES):
     return preview_html, more_count, lines
 
 
-def _apply_filters(data: list, q: str, cat: str) -> list:
-    filtered = data
-    
-    # Filter by Category
-    if cat != CATEGORY_ALL:
-        filtered = [d for d in filtered if d["category"] == cat]
-    
-    # Filter by Search Query (Name)
-    if q:
-        q_lower = q.lower()
-        filtered = [d for d in filtered if q_lower in d["name"].lower()]
-        
-    return filtered
+@st.cache_data(show_spinner=False, ttl=CATALOG_CACHE_TTL_SEC)
+def _load_data_cached(pkg_ver: str) -> list:
+    # pkg_ver is just for invalidation (bumped by every package write)
+    return _safe_load_data(active_only=False)
+
+
+def _apply_filters(data: list, status_filter: str, q: str, cat: str) -> List[int]:
+    """Status, category and name filters in one pass; returns indices into data."""
+    want_active = {"Active": True, "Archived": False}.get(status_filter)
+    q_lower = q.lower()
+    return [
+        i for i, d in enumerate(data)
+        if (want_active is None or bool(d.get('is_active', 1)) == want_active)
+        and (cat == CATEGORY_ALL or d["category"] == cat)
+        and (not q_lower or q_lower in d["name"].lower())
+    ]
 
 
-def _apply_sort(data: list, sort_label: str) -> list:
+def _apply_sort(data: list, idx: List[int], sort_label: str) -> List[int]:
     col, asc = SORT_OPTIONS.get(sort_label, ("id", False))
     
     # Python Sort (List of Dicts)
     # reverse=True artinya Descending (Kebalikan dari logic Pandas 'ascending')
-    return sorted(data, key=lambda x: x.get(col, 0), reverse=not asc)
+    return sorted(idx, key=lambda i: data[i].get(col, 0), reverse=not asc)
+
+
+@st.cache_data(show_spinner=False, ttl=CATALOG_CACHE_TTL_SEC)
+def _filter_sort_cached(_data: list, pkg_ver: str, n: int, status_filter: str, q: str, cat: str, sort_label: str) -> List[int]:
+    """Filtered + sorted indices, cached per (catalog version, filters)."""
+    return _apply_sort(_data, _apply_filters(_data, status_filter, q, cat), sort_label)
 
 
 # =========================================================
@@ -445,32 +456,24 @@ def _render_grid(data: list, cols_count: int, page_size: int = PAGE_SIZE_DEFAULT
     end = start + page_size
     page_data = data[start:end]
 
-    cols = st.columns(cols_count)
-    
-    # Loop over list of dicts (bukan itertuples lagi)
-    for idx, row in enumerate(page_data):
-        with cols[idx % cols_count]:
-            is_main = (row['category'] == CATEGORIES[0])
-            # Use reusable component
-            from views.styles import render_package_card
-            
-
-            
-            # Truncate description for card view
-            preview_html, more_count, _ = _desc_meta(row['description'])
-            
-            # Use the existing render_package_card but we might need to adjust it if it doesn't take raw HTML or list.
-            # Wait, render_package_card in views.styles likely takes a list or string.
-            # Let's look at how sidebar uses it: description=lines (list).
-            # existing usage here: description=row['description'] (string).
-            # I will pass the truncated list of lines.
-            
+    # Cards are batched one markdown per row (one grid row under the same
+    # column widths); each card's action buttons go in st.columns below it.
+    grid_open = f'<div class="catgrid" style="grid-template-columns: repeat({cols_count}, minmax(0, 1fr));">'
+    main_cat = CATEGORIES[0]
+    for r0 in range(0, len(page_data), cols_count):
+        chunk = page_data[r0:r0 + cols_count]
+        cards = [grid_open]
+        # Loop over list of dicts (bukan itertuples lagi)
+        for row in chunk:
+            is_main = (row['category'] == main_cat)
+
+            # Truncate description for card view (render_package_card takes a list)
             _, _, all_lines = _desc_meta(row['description'])
             display_lines = all_lines[:3]
             if len(all_lines) > 3:
                 display_lines.append(f"... (+{len(all_lines)-3} more)")
 
-            card_html = render_package_card(
+            cards.append(render_package_card(
                 name=row['name'],
                 price=row['price'],
                 description=display_lines, # Pass list
@@ -479,49 +482,55 @@ def _render_grid(data: list, cols_count: int, page_size: int = PAGE_SIZE_DEFAULT
                 compact=False,
                 rupiah_formatter=rupiah,
                 full_description=all_lines # Pass full text for hover
-            )
-
-            st.markdown(card_html, unsafe_allow_html=True)
+            ))
+        cards.append('</div>')
+        st.markdown("".join(cards), unsafe_allow_html=True)
+
+        cols = st.columns(cols_count)
+        for j, row in enumerate(chunk):
+            with cols[j]:
+                _render_grid_actions(row)
+        st.write("")
 
-            # Action Buttons: [Edit] [Archive/Restore] [Delete]
-            b1, b2, b3 = st.columns([1, 1, 1], gap="small")
-            
-            with b1:
-                # EDIT
-                if st.button("✏️", key=f"grid_edit_{row['id']}", help="Edit Package", use_container_width=True):
-                    st.session_state["_pkg_modal"] = ("edit", int(row['id']))
-                    st.rerun()
 
-            is_active = row.get('is_active', 1)
-            
-            with b2:
-                # TOGGLE STATUS
-                if is_active:
-                    if st.button("📦", key=f"grid_arch_{row['id']}", help="Archive", use_container_width=True):
-                        db.toggle_package_status(int(row['id']), False)
-                        st.toast(f"Archived '{row['name']}'", icon="📦")
-                        st.rerun()
-                else:
-                    if st.button("♻️", key=f"grid_rest_{row['id']}", help="Restore", use_container_width=True):
-                        db.toggle_package_status(int(row['id']), True)
-                        st.toast(f"Restored '{row['name']}'", icon="♻️")
-                        st.rerun()
+def _render_grid_actions(row: dict):
+    # Action Buttons: [Edit] [Archive/Restore] [Delete]
+    b1, b2, b3 = st.columns([1, 1, 1], gap="small")
+    
+    with b1:
+        # EDIT
+        if st.button("✏️", key=f"grid_edit_{row['id']}", help="Edit Package", use_container_width=True):
+            st.session_state["_pkg_modal"] = ("edit", int(row['id']))
+            st.rerun()
 
-            with b3:
-                # DELETE (Only if Archived for Safety, or Always?)
-                # User asked for "3 buttons", implying all visible?
-                # If Active, user SHOULD Archive first. So maybe disable Delete or hide it?
-                # "hapus juga ntar gaibisa haapus numpu" -> implied they want to delete OLD stuff (Archived).
-                # I'll show Delete ONLY if Archived to enforce the flow, or disabled if Active.
-                if not is_active:
-                     if st.button("🗑️", key=f"grid_del_{row['id']}", type="primary", help="Delete Permanently", use_container_width=True):
-                        st.session_state["_pkg_modal"] = ("delete", int(row['id']))
-                        st.rerun()
-                else:
-                     # Placeholder to keep alignment or disabled button
-                     st.button("🗑️", key=f"grid_del_dis_{row['id']}", disabled=True, help="Archive first to delete", use_container_width=True)
+    is_active = row.get('is_active', 1)
+    
+    with b2:
+        # TOGGLE STATUS
+        if is_active:
+            if st.button("📦", key=f"grid_arch_{row['id']}", help="Archive", use_container_width=True):
+                db.toggle_package_status(int(row['id']), False)
+                st.toast(f"Archived '{row['name']}'", icon="📦")
+                st.rerun()
+        else:
+            if st.button("♻️", key=f"grid_rest_{row['id']}", help="Restore", use_container_width=True):
+                db.toggle_package_status(int(row['id']), True)
+                st.toast(f"Restored '{row['name']}'", icon="♻️")
+                st.rerun()
 
-            st.write("")
+    with b3:
+        # DELETE (Only if Archived for Safety, or Always?)
+        # User asked for "3 buttons", implying all visible?
+        # If Active, user SHOULD Archive first. So maybe disable Delete or hide it?
+        # "hapus juga ntar gaibisa haapus numpu" -> implied they want to delete OLD stuff (Archived).
+        # I'll show Delete ONLY if Archived to enforce the flow, or disabled if Active.
+        if not is_active:
+             if st.button("🗑️", key=f"grid_del_{row['id']}", type="primary", help="Delete Permanently", use_container_width=True):
+                st.session_state["_pkg_modal"] = ("delete", int(row['id']))
+                st.rerun()
+        else:
+             # Placeholder to keep alignment or disabled button
+             st.button("🗑️", key=f"grid_del_dis_{row['id']}", disabled=True, help="Archive first to delete", use_container_width=True)
 
 
 # =========================================================
@@ -535,7 +544,12 @@ def render_page():
     )
 
     # Data Loading (Load ALL for filtering and modal lookup)
-    all_data = _safe_load_data(active_only=False) 
+    # Cached per package version: one config read instead of a full table load
+    try:
+        pkg_ver = db.get_package_version()
+    except Exception:
+        pkg_ver = ""
+    all_data = _load_data_cached(pkg_ver) if pkg_ver else _safe_load_data(active_only=False)
 
     # Modal handling
     # modal = st.session_state.pop("_pkg_modal", None) # Default pop causes close on rerun
@@ -576,23 +590,18 @@ def render_page():
             st.session_state["_pkg_modal"] = ("add", None)
             st.rerun()
 
-    # Filter by Status
-    if status_filter == "Active":
-        data = [d for d in all_data if d.get('is_active', 1)]
-    elif status_filter == "Archived":
-        data = [d for d in all_data if not d.get('is_active', 1)]
-    else:
-        data = all_data
-
     cols_count = 3
     sig = (q, cat, status_filter, sort) 
     if st.session_state.get("_pkg_sig") != sig:
         st.session_state["_pkg_sig"] = sig
         st.session_state["_pkg_page"] = 1
 
-    # Apply Logic Manual (List Comprehension)
-    filtered_data = _apply_filters(data, q, cat)
-    sorted_data = _apply_sort(filtered_data, sort)
+    # Apply Logic Manual (List Comprehension), cached per catalog version
+    if pkg_ver:
+        order = _filter_sort_cached(all_data, pkg_ver, len(all_data), status_filter, q, cat, sort)
+    else:
+        order = _apply_sort(all_data, _apply_filters(all_data, status_filter, q, cat), sort)
+    sorted_data = [all_data[i] for i in order]
 
     st.caption(f"📌 Showing **{len(sorted_data)}** of **{len(all_data)}** packages (Status: {status_filter})")
     st.write("")
@@ -1,7 +1,8 @@
 import streamlit as st
 from typing import List, Dict, Any
 from modules.utils import safe_float, normalize_desc_text, desc_to_lines, rupiah
-from controllers.invoice_callbacks import cb_add_item_to_cart, cb_delete_item_by_row_id
+from modules.invoice_state import CATALOG_CACHE_TTL_SEC
+from controllers.invoice_callbacks import cb_add_item_to_cart, cb_delete_item_by_row_id, cart_row_ids
 from views.styles import POS_COLUMN_RATIOS
 from views.invoice_components import render_package_card
 
@@ -15,7 +16,53 @@ CATEGORIES = [
   "Free / Complimentary"
 ]
 
-def render_sidebar_packages_v2(packages: List[Dict[str, Any]]) -> None:
+# Compact sidebar: items per page, per category (default 4)
+_CATEGORY_PAGE_LIMIT = {
+    "Wedding": 2,
+    "Engagement/Sangjit": 1,
+    "Bundling Package": 2,
+    "Prewedding": 1,
+    "Corporate/Event": 1,
+    "Add-ons": 1,
+    "Free / Complimentary": 1
+}
+
+# Category header colors (Synced with views/styles.py .pkg-pill)
+_CATEGORY_COLORS = {
+    "Wedding": "#fce7f3",             # Pink
+    "Bundling Package": "#e0e7ff",    # Indigo
+    "Prewedding": "#e0f2fe",          # Sky
+    "Engagement/Sangjit": "#ccfbf1",  # Teal
+    "Corporate/Event": "#f1f5f9",     # Slate
+    "Add-ons": "#fff7ed",             # Orange
+    "Free / Complimentary": "#dcfce7" # Green
+}
+
+@st.cache_data(show_spinner=False, ttl=CATALOG_CACHE_TTL_SEC)
+def _price_order_cached(_packages: List[Dict[str, Any]], pkg_ver: str, n_packages: int) -> List[int]:
+    """Package indices by price, high to low; computed once per catalog version."""
+    return sorted(range(len(_packages)), key=lambda i: _packages[i]["_price_f"], reverse=True)
+
+@st.cache_data(show_spinner=False, ttl=CATALOG_CACHE_TTL_SEC)
+def _filter_sort_cached(_packages: List[Dict[str, Any]], pkg_ver: str, n_packages: int,
+                        search_query: str, cart_ids: tuple) -> List[int]:
+    """Indices of packages matching search_query, added first then price desc.
+
+    _packages is not hashed; pkg_ver/n_packages identify the catalog instead.
+    """
+    order = _price_order_cached(_packages, pkg_ver, n_packages)
+    if search_query:
+        order = [i for i in order if search_query in _packages[i]["_name_lc"]]
+    if not cart_ids:
+        return order
+    # Stable partition == the old (in_cart, price) reverse sort, without re-sorting
+    cart = set(cart_ids)
+    added, rest = [], []
+    for i in order:
+        (added if str(_packages[i].get("id")) in cart else rest).append(i)
+    return added + rest
+
+def render_sidebar_packages_v2(packages: List[Dict[str, Any]], pkg_ver: str = "") -> None:
     """Refactored Sidebar: Cleaner, Modular, Limit 5."""
     
     st.markdown('<div class="sidebar-header"><h3>📦 Select Packages</h3></div>', unsafe_allow_html=True)
@@ -28,17 +75,20 @@ def render_sidebar_packages_v2(packages: List[Dict[str, Any]]) -> None:
     search_query = st.text_input("Search", placeholder="🔍 Search...", key="sb_search", label_visibility="collapsed").lower().strip()
     
     # Cart State
-    cart_ids = {str(item.get("_row_id")) for item in st.session_state.get("inv_items", [])}
+    cart_ids = cart_row_ids()
     
-    # Filter
-    filtered = [p for p in packages if search_query in str(p.get("name", "")).lower()] if search_query else packages
-    
-    # SORT: 1. Added (Top), 2. High Price to Low
-    filtered = sorted(
-        filtered, 
-        key=lambda x: (str(x.get("id")) in cart_ids, safe_float(x.get("price", 0))), 
-        reverse=True
-    )
+    # Filter + SORT: 1. Added (Top), 2. High Price to Low
+    # Cached per (catalog version, query, cart) so plain reruns skip the sort
+    if pkg_ver and packages:
+        order = _filter_sort_cached(packages, pkg_ver, len(packages), search_query, tuple(sorted(cart_ids)))
+        filtered = [packages[i] for i in order]
+    else:
+        filtered = [p for p in packages if search_query in p["_name_lc"]] if search_query else packages
+        filtered = sorted(
+            filtered, 
+            key=lambda x: (str(x.get("id")) in cart_ids, x["_price_f"]), 
+            reverse=True
+        )
     
     # Grouping
     grouped = {cat: [] for cat in CATEGORIES}
@@ -57,16 +107,7 @@ def render_sidebar_packages_v2(packages: List[Dict[str, Any]]) -> None:
         if not items: continue
         
         # Limit Logic: Tailored per category
-        limit_map = {
-            "Wedding": 2,
-            "Engagement/Sangjit": 1,
-            "Bundling Package": 2,
-            "Prewedding": 1,
-            "Corporate/Event": 1,
-            "Add-ons": 1,
-            "Free / Complimentary": 1
-        }
-        limit = limit_map.get(category, 4) # Default 4 for others (Add-ons, Free)
+        limit = _CATEGORY_PAGE_LIMIT.get(category, 4) # Default 4 for others (Add-ons, Free)
         
         # Pagination
         page_key = f"pge_{category}"
@@ -88,18 +129,7 @@ def render_sidebar_packages_v2(packages: List[Dict[str, Any]]) -> None:
         # Header (Category + Count)
         count_display = f"{len(display_items)}/{len(items)}"
         
-        # Color Map for Categories
-        # Color Map for Categories (Synced with views/styles.py .pkg-pill)
-        cat_colors = {
-            "Wedding": "#fce7f3",             # Pink
-            "Bundling Package": "#e0e7ff",    # Indigo
-            "Prewedding": "#e0f2fe",          # Sky
-            "Engagement/Sangjit": "#ccfbf1",  # Teal
-            "Corporate/Event": "#f1f5f9",     # Slate
-            "Add-ons": "#fff7ed",             # Orange
-            "Free / Complimentary": "#dcfce7" # Green
-        }
-        bg_color = cat_colors.get(category, "#f8fafc")
+        bg_color = _CATEGORY_COLORS.get(category, "#f8fafc")
         
         # Style: Simpler, closer to Streamlit native
         st.markdown(f'''
@@ -168,11 +198,9 @@ def _render_sidebar_item(pkg, cart_ids):
     pkg_id = str(pkg["id"])
     is_added = pkg_id in cart_ids
     
-    # Prepare lines for tooltip/desc
-    # Prepare lines for tooltip/desc
-    desc = pkg.get("description", "")
-    raw_lines = desc_to_lines(normalize_desc_text(desc))
-    lines = raw_lines[:3]
+    # Prepare lines for tooltip/desc (precomputed at catalog load)
+    raw_lines = pkg["_desc_lines"]
+    lines = list(raw_lines[:3])
     if len(raw_lines) > 3:
         lines.append(f"... (+{len(raw_lines)-3})")
     
@@ -183,7 +211,7 @@ def _render_sidebar_item(pkg, cart_ids):
         # Render Card HTML (using shared styles)
         html_code = render_package_card(
             name=pkg["name"], 
-            price=safe_float(pkg["price"]), 
+            price=pkg["_price_f"], 
             description=lines, # Pass list for bullets
             category=pkg.get("category"),
             is_added=is_added,
@@ -225,13 +253,24 @@ def _render_pagination(category, current, total, limit, key):
 
 
 # Removing @st.dialog decorator so it can be embedded in main page
-def render_full_catalog_content(packages: List[Dict[str, Any]]):
+@st.cache_data(show_spinner=False, ttl=CATALOG_CACHE_TTL_SEC)
+def _catalog_groups_cached(_packages: List[Dict[str, Any]], pkg_ver: str, n_packages: int,
+                           search: str) -> Dict[str, List[int]]:
+    """Category -> package indices (catalog order) matching search."""
+    grouped = {cat: [] for cat in CATEGORIES}
+    for i, p in enumerate(_packages):
+        if search and search not in p["_name_lc"]: continue
+        cat = p.get("category")
+        if cat in grouped: grouped[cat].append(i)
+    return grouped
+
+def render_full_catalog_content(packages: List[Dict[str, Any]], pkg_ver: str = ""):
     """Multi-select catalog with batch apply. Checkbox on top for animation."""
     
     # st.markdown style removed (no longer needed for modal width hack)
     
     # Source of truth
-    cart_ids = {str(item.get("_row_id")) for item in st.session_state.get("inv_items", [])}
+    cart_ids = cart_row_ids()
     
     # Pending state
     if "_pa" not in st.session_state: st.session_state._pa = set()
@@ -241,33 +280,26 @@ def render_full_catalog_content(packages: List[Dict[str, Any]]):
     # Search
     search = st.text_input("🔍 Search...", key="fc_s", label_visibility="collapsed").lower().strip()
     
-    # Group O(n)
-    grouped = {cat: [] for cat in CATEGORIES}
-    for p in packages:
-        if search and search not in p.get("name", "").lower(): continue
-        cat = p.get("category")
-        if cat in grouped: grouped[cat].append(p)
+    # Group O(n), cached per (catalog version, search)
+    if pkg_ver and packages:
+        groups = _catalog_groups_cached(packages, pkg_ver, len(packages), search)
+        grouped = {cat: [packages[i] for i in idx] for cat, idx in groups.items()}
+    else:
+        grouped = {cat: [] for cat in CATEGORIES}
+        for p in packages:
+            if search and search not in p["_name_lc"]: continue
+            cat = p.get("category")
+            if cat in grouped: grouped[cat].append(p)
     
     if not any(grouped.values()):
         st.info("No packages found.")
         return
     
-    # Color Map (Synced)
-    cat_colors = {
-        "Wedding": "#fce7f3",             # Pink
-        "Bundling Package": "#e0e7ff",    # Indigo
-        "Prewedding": "#e0f2fe",          # Sky
-        "Engagement/Sangjit": "#ccfbf1",  # Teal
-        "Corporate/Event": "#f1f5f9",     # Slate
-        "Add-ons": "#fff7ed",             # Orange
-        "Free / Complimentary": "#dcfce7" # Green
-    }
-
     # Render
     for cat, items in grouped.items():
         if not items: continue
         
-        bg_color = cat_colors.get(cat, "#f8fafc")
+        bg_color = _CATEGORY_COLORS.get(cat, "#f8fafc")
         
         st.markdown(f'''
             <div style="
@@ -286,6 +318,7 @@ def render_full_catalog_content(packages: List[Dict[str, Any]]):
         
         for i in range(0, len(items), 3):
             cols = st.columns(3)
+            cards = ['<div class="catgrid">']
             for j, pkg in enumerate(items[i:i+3]):
                 with cols[j]:
                     pid = str(pkg["id"])
@@ -295,22 +328,25 @@ def render_full_catalog_content(packages: List[Dict[str, Any]]):
                     # CHECKBOX FIRST (for animation)
                     chk = st.checkbox("" if is_sel else "", value=is_sel, key=f"fc_{pid}")
                     
-                    # Update pending
-                    if chk and not in_cart: pend_add.add(pid); pend_rem.discard(pid)
-                    elif not chk and in_cart: pend_rem.add(pid); pend_add.discard(pid)
-                    elif chk and in_cart: pend_rem.discard(pid)
-                    elif not chk and not in_cart: pend_add.discard(pid)
+                # Update pending
+                if chk and not in_cart: pend_add.add(pid); pend_rem.discard(pid)
+                elif not chk and in_cart: pend_rem.add(pid); pend_add.discard(pid)
+                elif chk and in_cart: pend_rem.discard(pid)
+                elif not chk and not in_cart: pend_add.discard(pid)
+                
+                # Card with CHECKBOX value for instant visual
+                desc_lines_raw = pkg["_desc_lines"]
+                desc_lines = list(desc_lines_raw[:3])
+                if len(desc_lines_raw) > 3:
+                    desc_lines.append(f"... (+{len(desc_lines_raw)-3})")
                     
-                    # Card with CHECKBOX value for instant visual
-                    desc_lines_raw = desc_to_lines(normalize_desc_text(pkg.get("description", "")))
-                    desc_lines = desc_lines_raw[:3]
-                    if len(desc_lines_raw) > 3:
-                        desc_lines.append(f"... (+{len(desc_lines_raw)-3})")
-                        
-                    html = render_package_card(pkg["name"], safe_float(pkg["price"]), desc_lines, 
-                                               pkg.get("category"), is_added=chk, compact=False, 
-                                               rupiah_formatter=rupiah, full_description=desc_lines_raw)
-                    st.markdown(html, unsafe_allow_html=True)
+                cards.append(render_package_card(pkg["name"], pkg["_price_f"], desc_lines, 
+                                                 pkg.get("category"), is_added=chk, compact=False, 
+                                                 rupiah_formatter=rupiah, full_description=desc_lines_raw))
+            # One markdown per row: the row's cards share a 3-col grid that
+            # lines up under the checkbox columns above.
+            cards.append('</div>')
+            st.markdown("".join(cards), unsafe_allow_html=True)
         st.markdown("---")
     
     # Summary & Apply
@@ -1,15 +1,16 @@
 import streamlit as st
-from typing import List
+from typing import Final, List
 
 POS_COLUMN_RATIOS = [2.2, 0.8, 0.6, 1.2, 0.5]  # Description | Price | Qty | Total | Del
 
 def _pos_grid_template(ratios: List[float]) -> str:
     return " ".join([f"{r}fr" for r in ratios])
 
-@st.cache_data(show_spinner=False)
+# CSS grid equivalent of POS_COLUMN_RATIOS, resolved once at import
+POS_GRID_TEMPLATE: Final = _pos_grid_template(POS_COLUMN_RATIOS)
+
 def get_invoice_css() -> str:
     """Returns CSS styles for the invoice view."""
-    grid = _pos_grid_template(POS_COLUMN_RATIOS)
     return f"""
     <style>
     /* --- FONT PERFORMANCE: swap injected via JS below --- */
@@ -61,6 +62,14 @@ def get_invoice_css() -> str:
         border-color: #d1d5db;
     }}
 
+    /* Full Catalog: one row of cards per markdown, aligned with st.columns(3) */
+    .catgrid {{
+        display: grid;
+        grid-template-columns: repeat(3, minmax(0, 1fr));
+        gap: 1rem;
+        margin-bottom: 1rem;
+    }}
+
     /* Base Card (Catalog & Sidebar) */
     .pkg-card {{
         background: #fff;
@@ -297,22 +306,34 @@ def get_invoice_css() -> str:
     </style>
     """
 
-def inject_styles() -> None:
-    st.markdown(get_invoice_css(), unsafe_allow_html=True)
-    # JS: Patch Streamlit's @font-face to use font-display: swap (saves ~600ms)
-    st.markdown("""<script>
+# Built once at import: the ratios are constants, so there is nothing to
+# re-format (or re-hash through st.cache_data) on every rerun.
+_INVOICE_CSS = get_invoice_css()
+
+# JS: Patch Streamlit's @font-face to use font-display: swap (saves ~600ms)
+_FONT_SWAP_JS = """<script>
 (function(){try{for(var i=0;i<document.styleSheets.length;i++){try{var rules=document.styleSheets[i].cssRules||[];for(var j=0;j<rules.length;j++){if(rules[j].type===5&&rules[j].style.fontFamily&&rules[j].style.fontFamily.indexOf('Material')!==-1){rules[j].style.fontDisplay='swap';}}}catch(e){}};}catch(e){}})();
-</script>""", unsafe_allow_html=True)
+</script>"""
+
+def inject_styles() -> None:
+    # Must be emitted on every run: Streamlit drops elements that a rerun
+    # does not re-send, so a "once per session" guard would unstyle the page.
+    # st.html skips the frontend markdown parser; style-only content is
+    # placed in the event container and takes no layout space.
+    st.html(_INVOICE_CSS)
+    st.markdown(_FONT_SWAP_JS, unsafe_allow_html=True)
 
 
 # ==============================================================================
 # UI COMPONENTS (Moved from ui/components.py)
 # ==============================================================================
-import html
 import textwrap
 from contextlib import contextmanager
+from functools import lru_cache
 from typing import Optional
 
+from modules.utils import sanitize_text
+
 def _next_key(prefix: str) -> str:
     """Generate a unique key per session (anti duplicate key)."""
     st.session_state.setdefault("_ui_seq", 0)
@@ -358,6 +379,44 @@ def muted_container():
             st.markdown("</div>", unsafe_allow_html=True)
 
 
+# Package card markup, formatted positionally by render_package_card:
+# {0} classes, {1} tooltip, {2} pill, {3} name, {4} badge, {5} price, {6} desc
+_CARD_TMPL = (
+    '<div class="{0}">{1}{2}'
+    '<div class="pkg-title">{3}{4}</div>'
+    '<div class="pkg-price">{5}</div>'
+    '<div class="pkg-desc">{6}</div>'
+    '</div>'
+)
+_CARD_TIP_TMPL = """
+            <div class="pkg-tip">
+                <div style="font-weight:700; margin-bottom:4px; color:#1f2937;">📋 Details</div>
+                {0}
+            </div>
+        """
+
+TIP_MAX_LINES = 8
+
+# Category -> .pkg-pill modifier class
+_CARD_PILL_CLASS = {
+    "Wedding": "cat-wedding",
+    "Bundling Package": "cat-bundling",
+    "Prewedding": "cat-prewedding",
+    "Engagement/Sangjit": "cat-engagement",
+    "Corporate/Event": "cat-corporate",
+    "Add-ons": "cat-addons",
+    "Free / Complimentary": "cat-free"
+}
+
+@lru_cache(maxsize=1024)
+def _package_tip_html(lines: tuple) -> str:
+    """Tooltip block for a description; cached since cards re-render every run."""
+    shown = [line for line in lines if line.strip()]
+    body = "<br>".join([f"• {sanitize_text(line)}" for line in shown[:TIP_MAX_LINES]])
+    if len(shown) > TIP_MAX_LINES:
+        body += f"<br>... (+{len(shown) - TIP_MAX_LINES} more)"
+    return _CARD_TIP_TMPL.format(body)
+
 def render_package_card(
     name: str,
     price: float,
@@ -376,7 +435,7 @@ def render_package_card(
     """
     
     # Safe text
-    safe_name = html.escape(str(name or "Unnamed"))
+    safe_name = sanitize_text(str(name or "Unnamed"))
     
     # Handle Description (List vs String)
     # For compact view, limit to 3 lines max
@@ -391,25 +450,22 @@ def render_package_card(
         else:
             display_lines = lines_filtered
             
-        if full_description:
-            # Use provided full list for tooltip
-            desc_text_for_title = "\n".join([f"• {line}" for line in full_description if line.strip()])
-        else:
-            # Use the filtered list (might be truncated already if caller passed truncated)
-            # This is fallback. Ideally caller passes full_description if they truncate 'description'
-            desc_text_for_title = "\n".join([f"• {line}" for line in lines_filtered])
+        # Tooltip source: provided full list, else the filtered list (might be
+        # truncated already if caller passed truncated). Built lazily below.
+        tip_lines = tuple(full_description) if full_description else tuple(lines_filtered)
             
         # Truncated for card display (already truncated by caller if passed as list usually, or we truncate here)
-        safe_desc = "<br>".join([f"• {html.escape(line)}" for line in display_lines])
+        safe_desc = "<br>".join([f"• {sanitize_text(line)}" for line in display_lines])
     else:
         desc_text = str(description or "")
+        tip_lines = None
         desc_text_for_title = str(full_description) if full_description else desc_text
         # Limit string by lines too
         lines = desc_text.split("\n")
         if len(lines) > max_lines:
             lines = lines[:max_lines]
             lines[-1] = lines[-1] + " ..."
-        safe_desc = "<br>".join([f"• {html.escape(line)}" for line in lines if line.strip()])
+        safe_desc = "<br>".join([f"• {sanitize_text(line)}" for line in lines if line.strip()])
     
     # Price formatting
     price_str = rupiah_formatter(price) if rupiah_formatter else f"Rp {price:,.0f}".replace(",", ".")
@@ -426,17 +482,8 @@ def render_package_card(
     # Pill (only if not compact)
     pill_html = ""
     if not compact and category:
-        cat_map = {
-            "Wedding": "cat-wedding",
-            "Bundling Package": "cat-bundling",
-            "Prewedding": "cat-prewedding",
-            "Engagement/Sangjit": "cat-engagement",
-            "Corporate/Event": "cat-corporate",
-            "Add-ons": "cat-addons",
-            "Free / Complimentary": "cat-free"
-        }
-        pill_class = cat_map.get(category, "main" if is_main else "addon")
-        pill_html = f'<span class="pkg-pill {pill_class}">{html.escape(category)}</span>'
+        pill_class = _CARD_PILL_CLASS.get(category, "main" if is_main else "addon")
+        pill_html = f'<span class="pkg-pill {pill_class}">{sanitize_text(category)}</span>'
         
     # Added Badge (inline in title)
     badge_html = ""
@@ -447,32 +494,14 @@ def render_package_card(
     # 1. Compact View (Sidebar): Fixed 2 lines.
     # 2. Tooltip: Hovering card shows full details in a nice bubble above.
     
-    # Native title backup (simple) - Removed to rely on pointer-events:none
-    # desc_html = f'<div class="pkg-desc" title="">{safe_desc}</div>'
-    desc_html = f'<div class="pkg-desc">{safe_desc}</div>'
-
     # Rich HTML Tooltip (The "Best Hover")
     # Positioned by CSS .pkg-tip (bottom: 100% -> appears above card)
     tooltip_html = ""
     if safe_desc:
-        tooltip_inner = f"""
-            <div class="pkg-tip">
-                <div style="font-weight:700; margin-bottom:4px; color:#1f2937;">📋 Details</div>
-                {html.escape(desc_text_for_title).replace(chr(10), "<br>")}
-            </div>
-        """
-        tooltip_html = tooltip_inner
-
-    # Construct final HTML
-    html_parts = [
-        f'<div class="{class_str}">',
-        tooltip_html, # Tooltip sits inside card, absolute positioned relative to card
-        pill_html,
-        f'<div class="pkg-title">{safe_name}{badge_html}</div>',
-        f'<div class="pkg-price">{price_str}</div>',
-        desc_html,
-        '</div>'
-    ]
+        if tip_lines is not None:
+            tooltip_html = _package_tip_html(tip_lines)
+        else:
+            tooltip_html = _CARD_TIP_TMPL.format(sanitize_text(desc_text_for_title).replace(chr(10), "<br>"))
 
-    
-    return "".join(html_parts)
+    # Tooltip sits inside card, absolute positioned relative to card
+    return _CARD_TMPL.format(class_str, tooltip_html, pill_html, safe_name, badge_html, price_str, safe_desc)